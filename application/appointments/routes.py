@@ -1,12 +1,66 @@
 import html
+import json
+import time
 from datetime import datetime, date, timedelta
-from flask import request, jsonify, make_response
+from flask import request, jsonify, make_response, Response
 from flask import current_app as app
+from application import db
+from application.events import broker
+from application.idempotency import idempotent
 from models.user import User
-from models.appointment import Appointment
-from models.therapist import Therapist, Specialism
+from models.appointment import Appointment, APPOINTMENT_TYPES
+from models.appointment_change import AppointmentChange
+from models.appointment_stat import AppointmentStat
+from models.therapist import Therapist, Specialism, mtm_assoc
 from application.main import generate_response
 from application.auth.routes import auth_token_required
+from application.tenancy import current_clinic
+from application.validation import Schema, json_args, parse_datetime
+from sqlalchemy import literal, select, union_all
+from sqlalchemy.orm import joinedload
+
+# Request schemas and lookups, compiled once at import
+NEW_APPOINTMENT = Schema(["start", "duration", "type", "therapist_id"])
+VALID_TYPES = frozenset(APPOINTMENT_TYPES)
+INVALID_TYPE_MESSAGE = f"Incorrect type. Must be one of {list(APPOINTMENT_TYPES)}"
+STATS_DIMENSIONS = ("therapist", "specialism", "type")
+APPOINTMENT_FILTERS = ("start", "end", "specialisms", "type")
+BATCH_QUERY = Schema([], types={k: str for k in ("id", *APPOINTMENT_FILTERS)})
+
+
+def appointment_filters(args):
+    """SQL conditions for the appointments matching a set of filters.
+
+    args takes the /get_appointments query parameters. Therapists are
+    matched in a subquery, so the filters can be used in a larger query.
+    """
+    # If start and end dates passed, limit to that date range
+    if "start" in args and "end" in args:
+        start = html.escape(args["start"])
+        end = html.escape(args["end"])
+    else:
+        start = date(1970, 1, 1)
+        end = datetime(2999, 12, 12)
+
+    # If specialisms passed, find therapists with those specialisms only
+    therapists = Therapist.scoped()
+    if "specialisms" in args:
+        specialisms = html.escape(args["specialisms"]).split(",")
+        therapists = therapists.filter(
+            Therapist.specialisms.any(Specialism.name.in_(specialisms))
+        )
+
+    # If a specific type passed, use that, otherwise use the default options
+    if "type" in args:
+        appt_type = [html.escape(args["type"])]
+    else:
+        appt_type = APPOINTMENT_TYPES
+
+    return [
+        Appointment.start_datetime.between(start, end),
+        Appointment.therapist_id.in_(therapists.with_entities(Therapist.id)),
+        Appointment.appointment_type.in_(appt_type),
+    ]
 
 
 @app.route("/get_appointments", methods=["GET"])
@@ -61,48 +115,11 @@ def get_appointments():
     if not arg_keys:
         return generate_response("No query parameters found.", 400)
 
-    # If start and end dates passed, limit to that date range
-    if "start" in arg_keys and "end" in arg_keys:
-        start = html.escape(args["start"])
-        end = html.escape(args["end"])
-    else:
-        start = date(1970, 1, 1)
-        end = datetime(2999, 12, 12)
-
-    # If specialisms passed, find therapists with those specialisms only
-    if "specialisms" in arg_keys:
-        specialisms = html.escape(args["specialisms"]).split(",")
-        therapists = Therapist.query.filter(
-            Therapist.specialisms.any(Specialism.name.in_(specialisms))
-        ).all()
-    else:
-        therapists = Therapist.query.all()
-
-    # If a specific type passed, use that, otherwise use the default options
-    if "type" in arg_keys:
-        appt_type = [html.escape(args["type"])]
-    else:
-        appt_type = Appointment.types()
-
     # Grab the list of appointments from the db according to filters
-    appointments = Appointment.query.filter(
-        Appointment.start_datetime.between(start, end),
-        Appointment.therapist_id.in_([x.id for x in therapists]),
-        Appointment.appointment_type.in_(appt_type),
-    ).all()
+    appointments = Appointment.query.filter(*appointment_filters(args)).all()
 
     # Parse the appointments so we have the correct format
-    parsed_appointments = list(
-        map(
-            lambda x: {
-                "time": x.start_datetime,
-                "duration": (x.end_datetime - x.start_datetime) / timedelta(minutes=1),
-                "therapist": x.therapist.name,
-                "type": x.appointment_type,
-            },
-            appointments,
-        )
-    )
+    parsed_appointments = list(map(lambda x: x.to_dict(), appointments))
 
     # Return the parsed appointments list
     return generate_response(
@@ -112,8 +129,107 @@ def get_appointments():
     )
 
 
+@app.route("/batch_appointments", methods=["POST"])
+@auth_token_required
+def batch_appointments():
+    """Get appointments for several sets of filters at once.
+
+    Every set of filters is run in a single SQL query, each tagged with the
+    id of the set it came from.
+
+    URL
+    ----------
+    POST /batch_appointments
+
+    Body
+    ----------
+    queries :
+        A list of filter sets, each taking the same filters as
+        /get_appointments, and optionally an id to key its results by.
+        Sets without an id are keyed by their position in the list.
+
+    Response
+    -------
+    400 :
+        Invalid or too many filter sets.
+    200 :
+          Queries run: {int}
+          Example :
+            {
+                "message": "Queries run: 2",
+                "results": {
+                    "addiction": [
+                        {
+                            "time": "2022-06-06 09:41:00",
+                            "duration": 60.0,
+                            "therapist": "John Smith",
+                            "type": "one-off",
+                        },
+                    ],
+                    "1": [],
+                },
+            }
+
+    """
+    args = json_args()
+
+    # args will only be a tuple if loading failed
+    if isinstance(args, tuple):
+        return args
+
+    queries = args.get("queries") if isinstance(args, dict) else None
+    if not isinstance(queries, list) or not queries:
+        return generate_response("queries must be a non-empty list.", 400)
+    limit = app.config.get("BATCH_MAX_QUERIES")
+    if len(queries) > limit:
+        return generate_response(f"No more than {limit} queries are allowed.", 400)
+
+    filter_sets = {}
+    for position, query in enumerate(queries):
+        if not isinstance(query, dict) or BATCH_QUERY.wrong_type(query):
+            return generate_response(f"Query {position} is invalid.", 400)
+        query_id = query.get("id", str(position))
+        filters = {k: v for k, v in query.items() if k != "id"}
+        if not filters or not set(filters).issubset(APPOINTMENT_FILTERS):
+            return generate_response(
+                f"Query {query_id} must use some of {list(APPOINTMENT_FILTERS)}.", 400
+            )
+        if query_id in filter_sets:
+            return generate_response(f"Duplicate query id {query_id}.", 400)
+        filter_sets[query_id] = filters
+
+    # One SELECT per filter set, tagged with its id
+    matches = union_all(
+        *(
+            select(
+                literal(query_id).label("query_id"),
+                Appointment.id.label("appointment_id"),
+            ).where(*appointment_filters(filters))
+            for query_id, filters in filter_sets.items()
+        )
+    ).subquery()
+    rows = (
+        db.session.query(matches.c.query_id, Appointment)
+        .join(Appointment, Appointment.id == matches.c.appointment_id)
+        .options(joinedload(Appointment.therapist))
+        .order_by(Appointment.start_datetime, Appointment.id)
+        .all()
+    )
+
+    # Appointments matching several filter sets are only serialised once
+    results = {query_id: [] for query_id in filter_sets}
+    parsed = {}
+    for query_id, appointment in rows:
+        if appointment.id not in parsed:
+            parsed[appointment.id] = appointment.to_dict()
+        results[query_id].append(parsed[appointment.id])
+
+    return generate_response(f"Queries run: {len(results)}", 200, results=results)
+
+
 @app.route("/add_appointment", methods=["POST"])
 @auth_token_required
+@idempotent
 def add_appointment():
     """Add new appointment.
 
@@ -132,6 +248,12 @@ def add_appointment():
     therapist_id :
         The id of the therapist to assign the appointment to.
 
+    Headers
+    ----------
+    Idempotency-Key :
+        Optional. A unique value per booking. Retrying with the same key
+        returns the first response instead of booking again.
+
     Response
     -------
     400 :
@@ -145,31 +267,25 @@ def add_appointment():
 
     """
     args = request.args
-    arg_keys = args.keys()
     # Only accept complete requests
-    if (
-        "start" not in arg_keys
-        or "duration" not in arg_keys
-        or "type" not in arg_keys
-        or "therapist_id" not in arg_keys
-    ):
+    if NEW_APPOINTMENT.missing(args):
         return generate_response(
             "Missing arguments. All of [start, duration, type, therapist_id] are required.",
             400,
         )
 
-    if args["type"] not in Appointment.types():
-        return generate_response(
-            f"Incorrect type. Must be one of {Appointment.types()}", 400
-        )
+    if args["type"] not in VALID_TYPES:
+        return generate_response(INVALID_TYPE_MESSAGE, 400)
 
-    therapist = Therapist.query.filter_by(id=html.escape(args["therapist_id"])).first()
+    therapist = (
+        Therapist.scoped().filter_by(id=html.escape(args["therapist_id"])).first()
+    )
     if therapist is None:
         return generate_response("Therapist not found.", 400)
 
     # Convert string times to datetime compatible objects
     try:
-        start = datetime.strptime(args["start"], "%Y-%m-%d %H:%M")
+        start = parse_datetime(args["start"])
         duration = timedelta(minutes=int(args["duration"]))
     except ValueError:
         return generate_response("Invalid start time or duration.", 400)
@@ -184,3 +300,291 @@ def add_appointment():
     else:
         code = 400
     return generate_response(res, code)
+
+
+@app.route("/sync_appointments", methods=["GET"])
+@auth_token_required
+def sync_appointments():
+    """Get the appointment changes made since a sync token.
+
+    Without a token every appointment is returned as an insert, along with
+    the token to send next time. Changes to the same appointment are
+    collapsed into the latest one. Treat an update for an unknown appointment
+    as an insert, as older changes are removed when the log is compacted.
+    A token from before the clinic was moved to another database gets every
+    appointment again with reset set, so replace the local copy with those.
+
+    URL
+    ----------
+    GET /sync_appointments
+
+    Query Parameters
+    ----------
+    token :
+        The sync_token from the previous response.
+
+    Response
+    -------
+    400 :
+        Invalid sync token.
+    200 :
+          Changes found: {int}
+          Example :
+            {
+                "message": "Changes found: 2",
+                "changes": [
+                    {
+                        "id": 5,
+                        "change": "insert",
+                        "time": "2022-06-06 09:41:00",
+                        "duration": 60.0,
+                        "therapist": "John Smith",
+                        "type": "one-off",
+                    },
+                    {"id": 3, "change": "delete"},
+                ],
+                "sync_token": 42,
+                "more": false,
+                "reset": false,
+            }
+
+    """
+    try:
+        token = int(request.args.get("token", 0))
+        if token < 0:
+            raise ValueError
+    except ValueError:
+        return generate_response("Invalid sync token.", 400)
+
+    clinic_id = current_clinic()
+
+    # No token, or one from before the clinic moved here, so send everything
+    reset = token != 0 and AppointmentChange.reset_since(token, clinic_id)
+    if token == 0 or reset:
+        # Take the token first, so anything changed while reading is resent
+        sync_token = AppointmentChange.latest(clinic_id)
+        query = Appointment.query.filter_by(clinic_id=clinic_id)
+        changes = list(
+            map(lambda x: {"id": x.id, "change": "insert", **x.to_dict()}, query)
+        )
+        return generate_response(
+            f"Changes found: {len(changes)}",
+            200,
+            changes=changes,
+            sync_token=sync_token,
+            more=False,
+            reset=reset,
+        )
+
+    page_size = app.config.get("SYNC_PAGE_SIZE")
+    log = AppointmentChange.since(token, clinic_id, page_size)
+    # Only the latest change to each appointment matters
+    latest = {x.appointment_id: x.change for x in log}
+    appointments = {
+        x.id: x
+        for x in Appointment.query.filter(
+            Appointment.id.in_([k for k, v in latest.items() if v != "delete"])
+        )
+    }
+
+    changes = []
+    for appointment_id, change in latest.items():
+        if change == "delete":
+            changes.append({"id": appointment_id, "change": change})
+        elif appointment_id in appointments:
+            changes.append(
+                {
+                    "id": appointment_id,
+                    "change": change,
+                    **appointments[appointment_id].to_dict(),
+                }
+            )
+        # Otherwise it has since been deleted, which a later page will include
+
+    return generate_response(
+        f"Changes found: {len(changes)}",
+        200,
+        changes=changes,
+        sync_token=log[-1].seq if log else token,
+        more=len(log) == page_size,
+        reset=False,
+    )
+
+
+@app.route("/stats", methods=["GET"])
+@auth_token_required
+def stats():
+    """Get booked minutes and appointment counts per day.
+
+    Read from the daily rollup, so the cost depends on the number of days and
+    therapists in range, not the number of appointments.
+
+    URL
+    ----------
+    GET /stats
+
+    Query Parameters
+    ----------
+    start :
+        A date formatted string defining the first day to include.
+    end :
+        A date formatted string defining the last day to include.
+    by :
+        A comma separated list of what to break each day down by. Any of
+        therapist, specialism and type. Defaults to therapist,type.
+
+    Response
+    -------
+    400 :
+        Invalid dates or breakdown.
+    200 :
+          Stats found: {int}
+          Example :
+            {
+                "message": "Stats found: 2",
+                "stats": [
+                    {
+                        "day": "2022-06-06",
+                        "therapist_id": 1,
+                        "therapist": "John Smith",
+                        "type": "one-off",
+                        "minutes": 120,
+                        "slots": 2,
+                    },
+                    {
+                        "day": "2022-06-06",
+                        "therapist_id": 2,
+                        "therapist": "Jane Smith",
+                        "type": "consultation",
+                        "minutes": 45,
+                        "slots": 1,
+                    },
+                ],
+            }
+
+    """
+    args = request.args
+    by = args.get("by", "therapist,type").split(",")
+    if not set(by) <= set(STATS_DIMENSIONS):
+        return generate_response(
+            f"Invalid breakdown. Must be made up of {list(STATS_DIMENSIONS)}", 400
+        )
+    try:
+        start = date.fromisoformat(args["start"]) if "start" in args else None
+        end = date.fromisoformat(args["end"]) if "end" in args else None
+    except ValueError:
+        return generate_response("Invalid start or end date.", 400)
+
+    columns = [AppointmentStat.day]
+    query = AppointmentStat.query
+    if "therapist" in by:
+        columns += [
+            Therapist.id.label("therapist_id"),
+            Therapist.name.label("therapist"),
+        ]
+        query = query.join(Therapist, Therapist.id == AppointmentStat.therapist_id)
+    if "specialism" in by:
+        columns.append(Specialism.name.label("specialism"))
+        query = query.join(
+            mtm_assoc, mtm_assoc.c.therapist_id == AppointmentStat.therapist_id
+        ).join(Specialism)
+    if "type" in by:
+        columns.append(AppointmentStat.appointment_type.label("type"))
+
+    if start is not None:
+        query = query.filter(AppointmentStat.day >= start)
+    if end is not None:
+        query = query.filter(AppointmentStat.day <= end)
+    query = query.filter(AppointmentStat.clinic_id == current_clinic())
+
+    rows = (
+        query.with_entities(
+            *columns,
+            db.func.sum(AppointmentStat.minutes).label("minutes"),
+            db.func.sum(AppointmentStat.slots).label("slots"),
+        )
+        .group_by(*columns)
+        .order_by(*columns)
+        .all()
+    )
+    parsed_stats = list(map(lambda x: {**x._asdict(), "day": x.day.isoformat()}, rows))
+    return generate_response(
+        f"Stats found: {len(parsed_stats)}", 200, stats=parsed_stats
+    )
+
+
+@app.route("/stream_appointments", methods=["GET"])
+@auth_token_required
+def stream_appointments():
+    """Stream appointment changes as server-sent events.
+
+    Each stream is closed after EVENTS_STREAM_SECONDS, well inside the
+    server's request timeout, so it only ties up a worker thread for a
+    bounded time. Clients reconnect (EventSource does so automatically) and
+    can catch up on anything missed in between with /sync_appointments.
+
+    URL
+    ----------
+    GET /stream_appointments
+
+    Query Parameters
+    ----------
+    specialisms :
+        A comma separated list of therapist specialisms to receive changes for.
+    type :
+        The type of appointments to receive changes for.
+
+    Response
+    -------
+    200 :
+          A text/event-stream of appointment changes. Comment lines are sent
+          as a keep-alive when there are no changes.
+          Example :
+            event: appointment
+            data: {"id": 5, "clinic_id": null, "change": "insert", "time": "2022-06-06 09:41:00",
+                   "duration": 60.0, "therapist": "John Smith", "type": "one-off",
+                   "specialisms": ["Addiction", "CBT"]}
+
+    """
+    args = request.args
+    specialisms = None
+    types = None
+    if "specialisms" in args:
+        specialisms = html.escape(args["specialisms"]).split(",")
+    if "type" in args:
+        types = [html.escape(args["type"])]
+
+    # Subscribe before returning so no changes are missed while streaming starts
+    broker.ensure_listener()
+    subscription = broker.subscribe(
+        current_clinic(),
+        specialisms,
+        types,
+        maxsize=app.config.get("EVENTS_BUFFER_SIZE"),
+    )
+    heartbeat = app.config.get("EVENTS_HEARTBEAT_SECONDS")
+    ends = time.monotonic() + app.config.get("EVENTS_STREAM_SECONDS")
+    retry = int(app.config.get("EVENTS_RETRY_SECONDS") * 1000)
+
+    def stream():
+        try:
+            # Send something straight away so the client sees the headers,
+            # along with how soon to reconnect once the stream closes
+            yield f": connected\nretry: {retry}\n\n"
+            while True:
+                remaining = ends - time.monotonic()
+                if remaining <= 0:
+                    return
+                event = subscription.get(timeout=min(heartbeat, remaining))
+                if event is not None:
+                    yield f"event: appointment\ndata: {json.dumps(event)}\n\n"
+                elif time.monotonic() < ends:
+                    yield ": keep-alive\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+
+    return Response(
+        stream(),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
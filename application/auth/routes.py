@@ -1,11 +1,15 @@
-import json
 import html
 from functools import wraps
-from flask import request
+from flask import g, request
 from flask import current_app as app
 from sqlalchemy import exc
-from application.main import generate_response
+from application.main import db, generate_response
+from application import tenancy
+from application.deadlines import timed_out
+from application.tenancy import current_clinic
+from application.validation import Schema, json_args
 from models.user import User
+from models.refresh_token import RefreshToken
 
 
 def auth_token_required(f):
@@ -17,33 +21,32 @@ def auth_token_required(f):
             # Get access token from header
             auth_header = request.headers.get("Authorization")
             access_token = auth_header.split(" ")[1]
-        except AttributeError:
+        except (AttributeError, IndexError):
             # Occurs in event of no Authorisation header
             return generate_response("Invalid Authorization token in header.", 401)
-        if access_token:
-            # Attempt to decode token for User ID
-            user_id = User.decode_token(access_token)
-            if not isinstance(user_id, str):
-                return f(*args, **kwargs)
-            else:
-                # String user_id indicates invalid token
-                return generate_response(user_id, 401)
+        if not access_token:
+            return generate_response("Invalid Authorization token in header.", 401)
+        # Attempt to decode token for User ID and clinic
+        decoded = User.decode_token(access_token)
+        if isinstance(decoded, str):
+            # String indicates invalid token
+            return generate_response(decoded, 401)
+        user_id, clinic_id = decoded
+        # The clinic comes from the token. A header can only confirm it.
+        if not tenancy.token_clinic_allowed(clinic_id):
+            return generate_response("Token is not valid for this clinic.", 403)
+        g.user_id = user_id
+        g.clinic_id = clinic_id
         return f(*args, **kwargs)
 
     return wrapper
 
 
-def get_args(data):
-    try:
-        # Data could be an already parsed dict or a json string
-        if isinstance(data, str):
-            return json.loads(data)
-        else:
-            return data
-    except TypeError:
-        return generate_response(f"Invalid JSON data supplied.", 400)
-    except json.decoder.JSONDecodeError:
-        return generate_response(f"Invalid JSON data supplied.", 400)
+# Request schemas, compiled once at import
+CREDENTIALS = Schema(
+    ["email", "password"], types={"email": str, "password": str}, exact=True
+)
+REFRESH = Schema(["refresh_token"], types={"refresh_token": str}, exact=True)
 
 
 @app.route("/register", methods=["POST"])
@@ -76,29 +79,35 @@ def register():
 
     """
     # Get the request arguments
-    args = get_args(request.json)
+    args = json_args()
 
     # args will only be a tuple if loading failed
     if isinstance(args, tuple):
         return args
 
     # Ensure we have both email and password
-    if list(args.keys()) != ["email", "password"]:
+    if CREDENTIALS.missing(args):
         return generate_response("email and/or password not passed with request.", 400)
 
     # Make sure that email and password are both string values
-    if not isinstance(args["email"], str) or not isinstance(args["password"], str):
+    if CREDENTIALS.wrong_type(args):
         return generate_response("Incorrect type for email and/or password.", 400)
 
+    # Clients can't choose their clinic, so new users join the deployment's
+    g.clinic_id = app.config.get("REGISTRATION_CLINIC")
+
     # Add a new user
     try:
-        user = User(html.escape(args["email"]))
+        user = User(html.escape(args["email"]), current_clinic())
         user.set_password(html.escape(args["password"]))
         user.save()
         return generate_response(f"Successfully registered new user: {user.email}", 201)
     except exc.IntegrityError:
         return generate_response(f"User already exists.", 400)
     except Exception as e:
+        if timed_out(e):
+            # Let the deadline handler turn timeouts into a 503
+            raise
         return generate_response(f"Error adding user.", 500)
 
 
@@ -130,19 +139,20 @@ def login():
           Example :
             {
                 "message": "Token generated with 5 minute expiration.",
-                "token": "token"
+                "token": "token",
+                "refresh_token": "refresh_token"
             }
 
     """
     # Get request arguments
-    args = get_args(request.json)
+    args = json_args()
 
     # Args will only be a tuple if loading failed
     if isinstance(args, tuple):
         return args
 
     # Ensure we have both email and password
-    if list(args.keys()) != ["email", "password"]:
+    if CREDENTIALS.missing(args):
         return generate_response("email and/or password not passed with request.", 400)
 
     try:
@@ -153,10 +163,122 @@ def login():
                 "Invalid email or password. Please try again.", 401
             )
 
-        # Generate and return token
+        # Generate and return tokens
         token = user.generate_token()
+        refresh_token = RefreshToken.issue(user)
+        db.session.commit()
         return generate_response(
-            "Token generated with 5 minute expiration.", 200, token=token
+            "Token generated with 5 minute expiration.",
+            200,
+            token=token,
+            refresh_token=refresh_token,
         )
     except Exception as e:
+        if timed_out(e):
+            # Let the deadline handler turn timeouts into a 503
+            raise
         return generate_response(f"Error retrieving token: {e}", 500)
+
+
+@app.route("/refresh", methods=["POST"])
+def refresh():
+    """Exchange a refresh token for a new access token.
+
+    The refresh token is rotated, so the one sent is no longer valid
+    afterwards and the new one must be used next time.
+
+    URL
+    ----------
+    POST /refresh
+
+    Body Parameters
+    ----------
+    refresh_token :
+        Refresh token from /login or a previous /refresh.
+
+    Response
+    -------
+    500:
+        Unknown error refreshing token.
+    401:
+        Invalid, expired or revoked refresh token.
+    400 :
+        Missing refresh token.
+    200 :
+          Token refreshed.
+          Example :
+            {
+                "message": "Token refreshed with 5 minute expiration.",
+                "token": "token",
+                "refresh_token": "refresh_token"
+            }
+
+    """
+    # Get request arguments
+    args = json_args()
+
+    # Args will only be a tuple if loading failed
+    if isinstance(args, tuple):
+        return args
+
+    if REFRESH.missing(args) or REFRESH.wrong_type(args):
+        return generate_response("refresh_token not passed with request.", 400)
+
+    try:
+        user, refresh_token = RefreshToken.rotate(args["refresh_token"])
+        # No user indicates an invalid token, refresh_token holds the reason
+        if user is None:
+            return generate_response(refresh_token, 401)
+
+        token = user.generate_token()
+        return generate_response(
+            "Token refreshed with 5 minute expiration.",
+            200,
+            token=token,
+            refresh_token=refresh_token,
+        )
+    except Exception as e:
+        if timed_out(e):
+            # Let the deadline handler turn timeouts into a 503
+            raise
+        return generate_response(f"Error refreshing token: {e}", 500)
+
+
+@app.route("/revoke", methods=["POST"])
+def revoke():
+    """Revoke a refresh token, e.g. on logout.
+
+    URL
+    ----------
+    POST /revoke
+
+    Body Parameters
+    ----------
+    refresh_token :
+        Refresh token to revoke.
+
+    Response
+    -------
+    400 :
+        Missing or unknown refresh token.
+    200 :
+          Token revoked.
+          Example :
+            {
+                "message": "Refresh token revoked.",
+            }
+
+    """
+    # Get request arguments
+    args = json_args()
+
+    # Args will only be a tuple if loading failed
+    if isinstance(args, tuple):
+        return args
+
+    if REFRESH.missing(args) or REFRESH.wrong_type(args):
+        return generate_response("refresh_token not passed with request.", 400)
+
+    if not RefreshToken.revoke(args["refresh_token"]):
+        return generate_response("Refresh token not found.", 400)
+    return generate_response("Refresh token revoked.", 200)
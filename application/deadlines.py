@@ -0,0 +1,107 @@
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context, request
+from sqlalchemy import event, exc
+
+from application.main import db, generate_response
+from application.tenancy import RoutingSession
+
+# SQLite VM instructions between deadline checks
+SQLITE_CHECK_INTERVAL = 1000
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request starts a transaction after its time budget ran out."""
+
+
+def budget(config, endpoint):
+    """Time budget in seconds for endpoint, or None for no limit."""
+    return config.get("ROUTE_TIMEOUTS").get(
+        endpoint, config.get("DEFAULT_ROUTE_TIMEOUT")
+    )
+
+
+def apply_deadline(session, transaction, connection):
+    """after_begin hook limiting the transaction to the request's remaining time.
+
+    Postgres gets a statement_timeout for the rest of the transaction. SQLite
+    gets a progress handler, which interrupts the running statement once the
+    deadline passes.
+    """
+    if not has_request_context() or "deadline" not in g:
+        return
+    deadline = g.deadline
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded()
+    if connection.dialect.name == "postgresql":
+        connection.exec_driver_sql(
+            f"SET LOCAL statement_timeout = {max(int(remaining * 1000), 1)}"
+        )
+    elif connection.dialect.name == "sqlite":
+        # The raw sqlite3 connection, which outlives this checkout from the pool
+        dbapi_connection = connection.connection.connection
+        dbapi_connection.set_progress_handler(
+            lambda: time.monotonic() > deadline, SQLITE_CHECK_INTERVAL
+        )
+        g.setdefault("deadline_connections", []).append(dbapi_connection)
+
+
+def timed_out(error):
+    """True if an error was caused by the request's deadline."""
+    if isinstance(error, DeadlineExceeded):
+        return True
+    if not isinstance(error, exc.OperationalError):
+        return False
+    # Postgres query_canceled
+    if getattr(error.orig, "pgcode", None) == "57014":
+        return True
+    return "deadline" in g and time.monotonic() > g.deadline
+
+
+def clear():
+    """Remove the request's deadline, and the SQLite handlers enforcing it."""
+    # Connections are pooled, so don't leave the handler behind
+    for dbapi_connection in g.pop("deadline_connections", []):
+        dbapi_connection.set_progress_handler(None, 0)
+    return g.pop("deadline", None)
+
+
+@contextmanager
+def suspended():
+    """Run transactions without the request's deadline.
+
+    For bookkeeping that has to happen even once the budget is spent.
+    """
+    deadline = clear() if has_request_context() else None
+    try:
+        yield
+    finally:
+        if deadline is not None:
+            g.deadline = deadline
+
+
+def init_app(app):
+    """Register the per-route deadline hooks on app."""
+    config = app.config
+
+    if not event.contains(RoutingSession, "after_begin", apply_deadline):
+        event.listen(RoutingSession, "after_begin", apply_deadline)
+
+    @app.before_request
+    def start_deadline():
+        seconds = budget(config, request.endpoint)
+        if seconds:
+            g.deadline = time.monotonic() + seconds
+
+    @app.teardown_request
+    def clear_deadline(error):
+        clear()
+
+    @app.errorhandler(DeadlineExceeded)
+    @app.errorhandler(exc.OperationalError)
+    def deadline_exceeded(error):
+        if not timed_out(error):
+            raise error
+        db.session.rollback()
+        return generate_response("Request took too long. Please try again.", 503)
@@ -0,0 +1,175 @@
+import json
+import logging
+import queue
+import select
+import threading
+from datetime import timedelta
+from flask import current_app as app
+from sqlalchemy import event, text
+from flask_sqlalchemy import SignallingSession
+
+from application.main import db
+
+logger = logging.getLogger("events")
+
+
+class Subscription(object):
+    """A single client's view of the appointment feed.
+
+    Events are held in a bounded buffer. If a client falls behind, the oldest
+    buffered events are dropped rather than letting memory grow without limit.
+    """
+
+    def __init__(self, clinic_id=None, specialisms=None, types=None, maxsize=100):
+        self.clinic_id = clinic_id
+        self.specialisms = frozenset(specialisms) if specialisms else None
+        self.types = frozenset(types) if types else None
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize)
+
+    def matches(self, event):
+        # Clinics only ever see their own appointments
+        if event.get("clinic_id") != self.clinic_id:
+            return False
+        if self.types is not None and event["type"] not in self.types:
+            return False
+        if self.specialisms is not None and self.specialisms.isdisjoint(
+            event["specialisms"]
+        ):
+            return False
+        return True
+
+    def put(self, event):
+        while True:
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """Return the next event, or None if none arrived within timeout."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class Broker(object):
+    """In-process fan out of appointment events to subscriptions."""
+
+    def __init__(self):
+        self._subscriptions = set()
+        self._lock = threading.Lock()
+        self._listeners = {}
+
+    def subscribe(self, clinic_id=None, specialisms=None, types=None, maxsize=100):
+        subscription = Subscription(clinic_id, specialisms, types, maxsize)
+        with self._lock:
+            self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions.discard(subscription)
+
+    def publish(self, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for subscription in subscriptions:
+            if subscription.matches(event):
+                subscription.put(event)
+
+    def ensure_listener(self):
+        """Start the Postgres LISTEN thread for the current database if needed.
+
+        There is one listener per database per process, so clinics on their
+        own shard get their own listener.
+        """
+        engine = db.session().get_bind()
+        if engine.dialect.name != "postgresql":
+            return
+        key = str(engine.url)
+        with self._lock:
+            listener = self._listeners.get(key)
+            if listener is not None and listener.is_alive():
+                return
+            self._listeners[key] = threading.Thread(
+                target=listen,
+                args=(self, engine, app.config.get("EVENTS_CHANNEL")),
+                daemon=True,
+            )
+            self._listeners[key].start()
+
+
+broker = Broker()
+
+
+def listen(target, engine, channel):
+    """Relay Postgres notifications on channel to the broker."""
+    connection = engine.raw_connection()
+    try:
+        connection.set_isolation_level(0)
+        cursor = connection.cursor()
+        cursor.execute(f'LISTEN "{channel}"')
+        while True:
+            if select.select([connection.connection], [], [], 5) == ([], [], []):
+                continue
+            connection.connection.poll()
+            while connection.connection.notifies:
+                notify = connection.connection.notifies.pop(0)
+                target.publish(json.loads(notify.payload))
+    except Exception:
+        logger.exception("Appointment event listener stopped.")
+    finally:
+        connection.close()
+
+
+def appointment_event(appointment, change):
+    """Build the feed representation of an appointment change."""
+    return {
+        "id": appointment.id,
+        "clinic_id": appointment.clinic_id,
+        "change": change,
+        "time": appointment.start_datetime.isoformat(sep=" "),
+        "duration": (appointment.end_datetime - appointment.start_datetime)
+        / timedelta(minutes=1),
+        "therapist": appointment.therapist.name,
+        "type": appointment.appointment_type,
+        "specialisms": [x.name for x in appointment.therapist.specialisms],
+    }
+
+
+def announce(appointment, change):
+    """Queue an appointment change to be published when the session commits.
+
+    On Postgres the event is sent with NOTIFY, which the database only
+    delivers on commit. Elsewhere it is held on the session and published to
+    the in-process broker by the after_commit hook below.
+    """
+    payload = appointment_event(appointment, change)
+    if db.session().get_bind().dialect.name == "postgresql":
+        db.session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {
+                "channel": app.config.get("EVENTS_CHANNEL"),
+                "payload": json.dumps(payload),
+            },
+        )
+    else:
+        db.session.info.setdefault("pending_events", []).append(payload)
+
+
+@event.listens_for(SignallingSession, "after_commit")
+def publish_pending(session):
+    for payload in session.info.pop("pending_events", []):
+        broker.publish(payload)
+
+
+@event.listens_for(SignallingSession, "after_rollback")
+def discard_pending(session):
+    session.info.pop("pending_events", None)
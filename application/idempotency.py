@@ -0,0 +1,131 @@
+import hashlib
+import threading
+import time
+from functools import wraps
+from flask import g, request
+from flask import current_app as app
+
+from application import deadlines
+from application.main import db, generate_response
+from models.idempotency_key import IdempotencyKey
+
+# Keys of the requests in flight in this process, and events set when they
+# finish. Duplicates arriving here wait on the event instead of polling.
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def fingerprint():
+    """Hash of the request, to spot a key reused for a different request."""
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.full_path.encode())
+    digest.update(request.get_data())
+    return digest.hexdigest()
+
+
+def replay(record):
+    response = app.response_class(
+        record.body, status=record.status_code, mimetype="application/json"
+    )
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def wait_for(key_hash):
+    """Wait for the request holding key_hash to finish.
+
+    Returns its row once finished, None if it gave up the key, or the row
+    still in flight if IDEMPOTENCY_WAIT_SECONDS, or the rest of this
+    request's time budget, passes first.
+    """
+    deadline = time.monotonic() + app.config.get("IDEMPOTENCY_WAIT_SECONDS")
+    if "deadline" in g:
+        deadline = min(deadline, g.deadline)
+    poll = app.config.get("IDEMPOTENCY_POLL_SECONDS")
+    # The wait is capped above, so the polls themselves don't time out
+    with deadlines.suspended():
+        while True:
+            with _inflight_lock:
+                done = _inflight.get(key_hash)
+            if done is not None:
+                done.wait(max(deadline - time.monotonic(), 0))
+            else:
+                # Held by another process
+                time.sleep(poll)
+            # End the transaction, so the other request's commit is visible
+            db.session.rollback()
+            record = IdempotencyKey.query.get(key_hash)
+            if record is None or record.status_code is not None:
+                return record
+            if time.monotonic() >= deadline:
+                return record
+
+
+def idempotent(f):
+    """Decorator letting clients safely retry a request.
+
+    Requests sent with an Idempotency-Key header run once per key and user.
+    Their response is stored for IDEMPOTENCY_TTL_SECONDS and returned to any
+    retry, which waits if the original is still in flight. Server errors
+    aren't stored, so those can be retried.
+    """
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get(app.config.get("IDEMPOTENCY_HEADER"))
+        if not key:
+            return f(*args, **kwargs)
+        if len(key) > 255:
+            return generate_response("Idempotency-Key is too long.", 400)
+
+        key_hash = IdempotencyKey.hash(g.get("user_id"), key)
+        digest = fingerprint()
+        while True:
+            record, claimed = IdempotencyKey.claim(key_hash, digest)
+            if claimed:
+                break
+            if record is None:
+                return generate_response(
+                    "A request with this Idempotency-Key is in progress.", 409
+                )
+            if record.fingerprint != digest:
+                return generate_response(
+                    "Idempotency-Key was already used for a different request.", 422
+                )
+            if record.status_code is None:
+                record = wait_for(key_hash)
+                if record is None:
+                    # The original failed and gave up the key, so run it here
+                    continue
+                if record.status_code is None:
+                    return generate_response(
+                        "A request with this Idempotency-Key is in progress.", 409
+                    )
+            return replay(record)
+
+        done = threading.Event()
+        with _inflight_lock:
+            _inflight[key_hash] = done
+        try:
+            try:
+                response = app.make_response(f(*args, **kwargs))
+            except Exception:
+                with deadlines.suspended():
+                    IdempotencyKey.release(key_hash)
+                raise
+            # Store the outcome even if the request ran out of time doing it
+            with deadlines.suspended():
+                if response.status_code >= 500:
+                    IdempotencyKey.release(key_hash)
+                else:
+                    IdempotencyKey.complete(
+                        key_hash, response.status_code, response.get_data(as_text=True)
+                    )
+            return response
+        finally:
+            with _inflight_lock:
+                _inflight.pop(key_hash, None)
+            done.set()
+
+    return wrapper
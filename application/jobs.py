@@ -0,0 +1,121 @@
+import logging
+import time
+from datetime import datetime, timedelta
+from flask import current_app as app
+
+from application.main import db
+from models.job import Job
+
+logger = logging.getLogger("jobs")
+
+# Registered job handlers, keyed by job name
+handlers = {}
+
+
+def job(name):
+    """Decorator to register a function as the handler for a named job."""
+
+    def decorator(f):
+        handlers[name] = f
+        return f
+
+    return decorator
+
+
+def enqueue(name, **payload):
+    """Add a job to the current session.
+
+    The job row is committed in the same transaction as the caller's work, so
+    a job is only ever picked up once the change it relates to is visible.
+    Call `dispatch` with the returned job after committing.
+    """
+    new_job = Job(name, payload, app.config.get("JOB_MAX_ATTEMPTS"))
+    db.session.add(new_job)
+    return new_job
+
+
+def dispatch(queued_job):
+    """Hand a committed job over for processing.
+
+    In synchronous mode (used for tests) the job is run inline, otherwise it
+    is left for a worker to claim.
+    """
+    if app.config.get("JOBS_SYNCHRONOUS"):
+        queued_job.status = "running"
+        queued_job.attempts += 1
+        db.session.commit()
+        execute(queued_job)
+
+
+def backoff(attempts):
+    """Exponential backoff delay before retrying a job."""
+    delay = app.config.get("JOB_BACKOFF_SECONDS") * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, app.config.get("JOB_BACKOFF_MAX_SECONDS")))
+
+
+def claim(batch_size):
+    """Claim a batch of due jobs.
+
+    Rows are locked with SKIP LOCKED so concurrent workers never claim the
+    same job. Claimed jobs are leased by pushing run_at forwards, so jobs held
+    by a worker that dies are picked up again once the lease expires.
+    """
+    now = datetime.utcnow()
+    jobs = (
+        Job.query.filter(
+            Job.status.in_(["queued", "running"]),
+            Job.run_at <= now,
+        )
+        .order_by(Job.run_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+        .all()
+    )
+    lease = timedelta(seconds=app.config.get("JOB_LEASE_SECONDS"))
+    for claimed in jobs:
+        claimed.status = "running"
+        claimed.attempts += 1
+        claimed.run_at = now + lease
+    db.session.commit()
+    return jobs
+
+
+def execute(running_job):
+    """Run a claimed job, scheduling a retry if it fails."""
+    try:
+        handler = handlers[running_job.name]
+        handler(**running_job.kwargs)
+        running_job.status = "done"
+        running_job.last_error = None
+    except Exception as e:
+        db.session.rollback()
+        logger.exception("Job %s failed.", running_job)
+        running_job.last_error = repr(e)
+        if running_job.attempts >= running_job.max_attempts:
+            running_job.status = "failed"
+        else:
+            running_job.status = "queued"
+            running_job.run_at = datetime.utcnow() + backoff(running_job.attempts)
+    db.session.commit()
+
+
+def work(batch_size=10, idle_sleep=1.0, once=False):
+    """Process jobs until stopped, or until the queue is empty if once is set."""
+    while True:
+        jobs = claim(batch_size)
+        for claimed in jobs:
+            execute(claimed)
+        if not jobs:
+            if once:
+                return
+            time.sleep(idle_sleep)
+
+
+@job("user_registered")
+def audit_user_registered(user_id):
+    logger.info("User registered.", extra={"user_id": user_id})
+
+
+@job("appointment_booked")
+def audit_appointment_booked(appointment_id):
+    logger.info("Appointment booked.", extra={"appointment_id": appointment_id})
@@ -0,0 +1,139 @@
+import atexit
+import copy
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+
+class SamplingFilter(logging.Filter):
+    """Let through at most `burst` copies of the same message per window.
+
+    The first record let through after some were suppressed carries a
+    `suppressed` count, so the volume of an error storm is still visible.
+    """
+
+    def __init__(self, window, burst):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(record):
+        msg = record.msg
+        # generate_response logs dicts, which are keyed by their message
+        if isinstance(msg, dict):
+            msg = msg.get("message")
+        return record.name, record.levelno, str(msg)
+
+    def filter(self, record):
+        now = time.monotonic()
+        key = self.key(record)
+        with self._lock:
+            start, count, suppressed = self._seen.get(key, (now, 0, 0))
+            if now - start >= self.window:
+                start, count = now, 0
+            if count >= self.burst:
+                self._seen[key] = (start, count, suppressed + 1)
+                return False
+            self._seen[key] = (start, count + 1, 0)
+            # Forget old messages so the table doesn't grow without limit
+            if len(self._seen) > 1000:
+                self._seen = {
+                    k: v for k, v in self._seen.items() if now - v[0] < self.window
+                }
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class AsyncHandler(QueueHandler):
+    """Hand records to a background thread which passes them on to `target`.
+
+    The queue is bounded, so if the target can't keep up records are dropped
+    rather than blocking the caller. The number dropped is attached to the
+    next record that gets through. The listener thread is started lazily in
+    each process, so the handler works in forked uWSGI workers.
+    """
+
+    def __init__(self, target, maxsize):
+        super().__init__(queue.Queue(maxsize))
+        self.target = target
+        self.dropped = 0
+        self._pending_dropped = 0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+        atexit.register(self.stop)
+
+    def start(self):
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._listener = QueueListener(
+                self.queue, self.target, respect_handler_level=True
+            )
+            self._listener.start()
+            self._pid = os.getpid()
+
+    def stop(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._pid = None
+
+    def prepare(self, record):
+        # Unlike QueueHandler.prepare, leave dict messages intact for the
+        # JSON formatter and don't format anything on the calling thread.
+        record = copy.copy(record)
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if not isinstance(record.msg, dict):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        if self._pid != os.getpid():
+            self.start()
+        if self._pending_dropped:
+            record.dropped = self._pending_dropped
+        try:
+            self.queue.put_nowait(record)
+            self._pending_dropped = 0
+        except queue.Full:
+            self.dropped += 1
+            self._pending_dropped += 1
+
+
+def setup_logging(config):
+    """Move the handlers set up by logging.ini onto background threads.
+
+    Every handler on the root and main loggers is replaced with an
+    AsyncHandler wrapping it. Safe to call more than once.
+    """
+    if not config.get("LOG_ASYNC"):
+        return
+    wrapped = {}
+    for logger in (logging.getLogger(), logging.getLogger("main")):
+        for handler in list(logger.handlers):
+            if isinstance(handler, AsyncHandler):
+                continue
+            if handler not in wrapped:
+                async_handler = AsyncHandler(handler, config.get("LOG_QUEUE_SIZE"))
+                async_handler.setLevel(handler.level)
+                if config.get("LOG_SAMPLE_BURST"):
+                    async_handler.addFilter(
+                        SamplingFilter(
+                            config.get("LOG_SAMPLE_WINDOW_SECONDS"),
+                            config.get("LOG_SAMPLE_BURST"),
+                        )
+                    )
+                wrapped[handler] = async_handler
+            logger.removeHandler(handler)
+            logger.addHandler(wrapped[handler])
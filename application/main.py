@@ -4,8 +4,19 @@ from flask import Flask, make_response, jsonify
 from config import configurations
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from sqlalchemy import orm
+from application import profiling, search, tenancy
+from application.logs import setup_logging
 
-db = SQLAlchemy()
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy extension whose sessions route to the current clinic's shard."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=tenancy.RoutingSession, db=self, **options)
+
+
+db = RoutingSQLAlchemy()
 migrate = Migrate()
 
 # Set up logging
@@ -30,17 +41,33 @@ def create_app(config):
     """Factory to set up the flask app."""
     # Import the relevant models
     from models.appointment import Appointment
+    from models.appointment_change import AppointmentChange
+    from models.appointment_stat import AppointmentStat
+    from models.idempotency_key import IdempotencyKey
+    from models.job import Job
+    from models.refresh_token import RefreshToken
     from models.therapist import Therapist, Specialism
     from models.user import User
+    from application import deadlines
 
     # Set up and configure the app and db objects
     app = Flask(__name__)
     app.config.from_object(configurations[config])
+    setup_logging(app.config)
+    app.config["SQLALCHEMY_BINDS"] = {
+        **(app.config.get("SQLALCHEMY_BINDS") or {}),
+        **tenancy.tenant_binds(app.config["TENANT_DATABASES"]),
+    }
+    app.before_request(tenancy.load_clinic)
+    profiling.init_app(app)
+    deadlines.init_app(app)
+    search.configure(app.config)
     db.init_app(app)
     migrate.init_app(app, db)
     # Register the routes
     with app.app_context():
         import application.auth.routes
         import application.appointments.routes
+        import application.therapists.routes
 
     return app
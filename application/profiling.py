@@ -0,0 +1,118 @@
+import cProfile
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from flask import g, request
+
+
+class StackSampler(threading.Thread):
+    """Statistical profiler sampling one thread's stack at a fixed interval.
+
+    Produces collapsed stacks ("outer;inner;leaf count" per line), the input
+    format for flame graph tools.
+    """
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+                )
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+    def dump(self, path):
+        with open(path, "w") as f:
+            for stack, count in self.stacks.items():
+                f.write(f"{stack} {count}\n")
+
+
+def should_profile(config):
+    """True if this request was picked for profiling by header or sampling."""
+    token = config.get("PROFILING_TOKEN")
+    header = request.headers.get(config.get("PROFILING_HEADER"))
+    if token and header and hmac.compare_digest(header, token):
+        return True
+    return random.random() < config.get("PROFILING_SAMPLE_RATE")
+
+
+def init_app(app):
+    """Register the profiling hooks on app.
+
+    Nothing is registered unless PROFILING_ENABLED is set, so profiling adds
+    no overhead at all when disabled.
+    """
+    config = app.config
+    if not config.get("PROFILING_ENABLED"):
+        return
+
+    @app.before_request
+    def start_profiling():
+        if not should_profile(config):
+            return
+        if config.get("PROFILING_MODE") == "sampler":
+            profiler = StackSampler(
+                threading.get_ident(), config.get("PROFILING_SAMPLE_INTERVAL")
+            )
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        g.profiler = profiler
+        g.profile_started = time.perf_counter()
+
+    def finish_profiling():
+        """Stop the request's profiler, if any, returning where it was written."""
+        profiler = g.pop("profiler", None)
+        if profiler is None:
+            return None
+        elapsed = time.perf_counter() - g.pop("profile_started")
+        name = "{0}-{1}-{2:.0f}ms-{3}".format(
+            time.strftime("%Y%m%d%H%M%S"),
+            request.endpoint,
+            elapsed * 1000,
+            uuid.uuid4().hex[:8],
+        )
+        os.makedirs(config.get("PROFILING_DIR"), exist_ok=True)
+        if isinstance(profiler, StackSampler):
+            profiler.stop()
+            path = os.path.join(config.get("PROFILING_DIR"), f"{name}.folded")
+            profiler.dump(path)
+        else:
+            profiler.disable()
+            path = os.path.join(config.get("PROFILING_DIR"), f"{name}.prof")
+            profiler.dump_stats(path)
+        return path
+
+    @app.after_request
+    def stop_profiling(response):
+        path = finish_profiling()
+        if path is not None:
+            response.headers["X-Profile-Output"] = os.path.basename(path)
+        return response
+
+    @app.teardown_request
+    def stop_failed_profiling(error):
+        # after_request is skipped when a view's exception propagates, so the
+        # profiler would otherwise keep running for the rest of the process
+        finish_profiling()
@@ -0,0 +1,95 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+# Characters kept in a search term. Anything else can't be part of a name and
+# would need escaping in LIKE patterns and FTS queries.
+UNSEARCHABLE = re.compile(r"[^\w\s'-]")
+
+
+def normalise(term):
+    """Lowercase term, drop unsearchable characters and collapse whitespace."""
+    return " ".join(UNSEARCHABLE.sub("", term or "").lower().split())
+
+
+def trigrams(term):
+    """Trigrams of each word in term, padded the same way as pg_trgm."""
+    grams = set()
+    for word in re.findall(r"\w+", term.lower()):
+        word = f"  {word} "
+        grams.update(word[i : i + 3] for i in range(len(word) - 2))
+    return grams
+
+
+def padded(term):
+    """term with its words padded the way pg_trgm pads them for trigrams.
+
+    The result contains every trigram in trigrams(term), and each word
+    starts after two spaces, so LIKE "%  {prefix}%" matches any word prefix.
+    """
+    return "".join(f"  {x} " for x in term.lower().split())
+
+
+def escape_like(term):
+    """term with LIKE wildcards escaped by backslashes. _ is kept by normalise."""
+    return re.sub(r"([\\%_])", r"\\\1", term)
+
+
+def similarity(a, b):
+    """Share of trigrams in common, as pg_trgm's similarity() calculates it."""
+    a, b = trigrams(a), trigrams(b)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class QueryCache:
+    """Thread safe LRU cache whose entries expire after ttl seconds.
+
+    clear() bumps a generation counter. Results computed before a clear
+    aren't stored, so a query racing a write can't put stale results back.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, generation):
+        with self._lock:
+            if generation != self.generation or not self.maxsize:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+
+cache = QueryCache(maxsize=1024, ttl=60)
+
+
+def configure(config):
+    """Size the module cache from the app config."""
+    cache.maxsize = config.get("SEARCH_CACHE_SIZE")
+    cache.ttl = config.get("SEARCH_CACHE_SECONDS")
+    cache.clear()
@@ -0,0 +1,240 @@
+from datetime import datetime
+from flask import g, has_app_context, request
+from flask import current_app as app
+from flask_sqlalchemy import SignallingSession, get_state
+from sqlalchemy import func, select, text
+
+# Prefix for the SQLALCHEMY_BINDS keys generated from TENANT_DATABASES
+BIND_PREFIX = "tenant:"
+
+
+def bind_key(clinic_id):
+    return f"{BIND_PREFIX}{clinic_id}"
+
+
+def tenant_binds(tenant_databases):
+    """Map each sharded clinic to a Flask-SQLAlchemy bind."""
+    return {bind_key(k): v for k, v in tenant_databases.items()}
+
+
+def current_clinic():
+    """Clinic id for the current request or command, if any."""
+    if not has_app_context():
+        return None
+    return g.get("clinic_id")
+
+
+def current_bind_key():
+    """Bind key of the shard holding the current clinic's data.
+
+    Clinics without an entry in TENANT_DATABASES live on the default database.
+    """
+    clinic_id = current_clinic()
+    if clinic_id is None or clinic_id not in app.config.get("TENANT_DATABASES"):
+        return None
+    return bind_key(clinic_id)
+
+
+def load_clinic():
+    """before_request hook reading the clinic id from the request headers.
+
+    Only used to pick the shard for unauthenticated requests, e.g. /login.
+    auth_token_required replaces it with the clinic in the access token.
+    """
+    g.clinic_id = request.headers.get(app.config.get("TENANT_HEADER"))
+
+
+def token_clinic_allowed(clinic_id):
+    """False if the request's clinic header names a clinic other than clinic_id."""
+    header = request.headers.get(app.config.get("TENANT_HEADER"))
+    return header is None or header == clinic_id
+
+
+class RoutingSession(SignallingSession):
+    """Session sending every query to the current clinic's shard."""
+
+    def get_bind(self, mapper=None, clause=None):
+        key = current_bind_key()
+        if key is not None:
+            return get_state(self.app).db.get_engine(self.app, bind=key)
+        return SignallingSession.get_bind(self, mapper, clause)
+
+
+def engine_for(clinic_id, db):
+    """Engine currently holding clinic_id's data."""
+    if clinic_id in app.config.get("TENANT_DATABASES"):
+        return db.get_engine(app, bind=bind_key(clinic_id))
+    return db.engine
+
+
+def move_tenant(clinic_id, source, target, metadata):
+    """Copy a clinic's rows from the source engine to the target, then delete them.
+
+    Primary keys are reassigned on the target so the clinic can be moved onto
+    a shard already holding other clinics. Specialisms are shared between
+    clinics and are matched by name. The target commits before the source, so
+    a failure part way through can leave a copy behind but never loses data.
+
+    The clinic's rows are locked as they are read (on databases supporting
+    SELECT ... FOR UPDATE), which holds back bookings against its therapists
+    until the move finishes. Only the rows that were copied are deleted, so
+    anything added to the clinic mid-move stays on the source.
+
+    Appointments get new ids, so the clinic's change log isn't copied.
+    Instead the target's change log sequence is moved past the source's, and
+    a reset marker is logged there, so any sync token from before the move
+    gets a full resync.
+    """
+    tables = metadata.tables
+    users = tables["users"]
+    therapists = tables["therapists"]
+    appointments = tables["appointments"]
+    specialisms = tables["specialism"]
+    therapist_specialisms = tables["therapist_specialisms"]
+    refresh_tokens = tables["refresh_tokens"]
+    appointment_stats = tables["appointment_stats"]
+    appointment_changes = tables["appointment_changes"]
+
+    metadata.create_all(target)
+    with source.begin() as src, target.begin() as dst:
+        # Users, and the refresh tokens that belong to them
+        user_ids = {}
+        for row in src.execute(
+            select(users).where(users.c.clinic_id == clinic_id).with_for_update()
+        ):
+            values = dict(row._mapping)
+            old_id = values.pop("id")
+            user_ids[old_id] = dst.execute(
+                users.insert().values(**values)
+            ).inserted_primary_key[0]
+        tokens = src.execute(
+            select(refresh_tokens)
+            .where(refresh_tokens.c.user_id.in_(list(user_ids)))
+            .with_for_update()
+        ).all()
+        for row in tokens:
+            values = dict(row._mapping)
+            values["user_id"] = user_ids[values["user_id"]]
+            dst.execute(refresh_tokens.insert().values(**values))
+
+        # Therapists and their specialisms
+        therapist_ids = {}
+        for row in src.execute(
+            select(therapists)
+            .where(therapists.c.clinic_id == clinic_id)
+            .with_for_update()
+        ):
+            values = dict(row._mapping)
+            old_id = values.pop("id")
+            therapist_ids[old_id] = dst.execute(
+                therapists.insert().values(**values)
+            ).inserted_primary_key[0]
+        links = src.execute(
+            select(therapist_specialisms.c.therapist_id, specialisms.c.name)
+            .join(specialisms)
+            .where(therapist_specialisms.c.therapist_id.in_(list(therapist_ids)))
+        ).all()
+        specialism_ids = {}
+        for therapist_id, name in links:
+            if name not in specialism_ids:
+                existing = dst.execute(
+                    select(specialisms.c.id).where(specialisms.c.name == name)
+                ).scalar()
+                if existing is None:
+                    existing = dst.execute(
+                        specialisms.insert().values(name=name)
+                    ).inserted_primary_key[0]
+                specialism_ids[name] = existing
+            dst.execute(
+                therapist_specialisms.insert().values(
+                    therapist_id=therapist_ids[therapist_id],
+                    specialism_id=specialism_ids[name],
+                )
+            )
+
+        # Appointments
+        moved = src.execute(
+            select(appointments)
+            .where(appointments.c.clinic_id == clinic_id)
+            .with_for_update()
+        ).all()
+        for row in moved:
+            values = dict(row._mapping)
+            values.pop("id")
+            values["therapist_id"] = therapist_ids.get(values["therapist_id"])
+            values["client_id"] = user_ids.get(values["client_id"])
+            dst.execute(appointments.insert().values(**values))
+        stats = src.execute(
+            select(appointment_stats)
+            .where(appointment_stats.c.clinic_id == clinic_id)
+            .with_for_update()
+        ).all()
+        for row in stats:
+            values = dict(row._mapping)
+            values["therapist_id"] = therapist_ids.get(values["therapist_id"])
+            dst.execute(appointment_stats.insert().values(**values))
+
+        # The change log, replaced by a reset marker after every source token
+        logged = (
+            src.execute(
+                select(appointment_changes.c.seq)
+                .where(appointment_changes.c.clinic_id == clinic_id)
+                .with_for_update()
+            )
+            .scalars()
+            .all()
+        )
+        floor = src.execute(select(func.max(appointment_changes.c.seq))).scalar() or 0
+        marker = {
+            "change": "reset",
+            "clinic_id": clinic_id,
+            "changed_at": datetime.utcnow(),
+        }
+        if target.dialect.name == "postgresql":
+            dst.execute(
+                text(
+                    "SELECT setval(pg_get_serial_sequence('appointment_changes', 'seq'),"
+                    " GREATEST(:floor, nextval(pg_get_serial_sequence("
+                    "'appointment_changes', 'seq'))))"
+                ),
+                {"floor": floor},
+            )
+        else:
+            latest = dst.execute(select(func.max(appointment_changes.c.seq))).scalar()
+            marker["seq"] = max(floor, latest or 0) + 1
+        dst.execute(appointment_changes.insert().values(**marker))
+
+        # Remove what was copied from the source
+        src.execute(
+            appointment_changes.delete().where(appointment_changes.c.seq.in_(logged))
+        )
+        src.execute(
+            appointments.delete().where(appointments.c.id.in_([x.id for x in moved]))
+        )
+        for row in stats:
+            src.execute(
+                appointment_stats.delete().where(
+                    appointment_stats.c.day == row.day,
+                    appointment_stats.c.therapist_id == row.therapist_id,
+                    appointment_stats.c.appointment_type == row.appointment_type,
+                )
+            )
+        src.execute(
+            therapist_specialisms.delete().where(
+                therapist_specialisms.c.therapist_id.in_(list(therapist_ids))
+            )
+        )
+        src.execute(therapists.delete().where(therapists.c.id.in_(list(therapist_ids))))
+        src.execute(
+            refresh_tokens.delete().where(
+                refresh_tokens.c.token_hash.in_([x.token_hash for x in tokens])
+            )
+        )
+        src.execute(users.delete().where(users.c.id.in_(list(user_ids))))
+
+        counts = {
+            "users": len(user_ids),
+            "therapists": len(therapist_ids),
+            "appointments": len(moved),
+        }
+    return counts
@@ -0,0 +1,84 @@
+from flask import request
+from flask import current_app as app
+from models.therapist import Therapist
+from application.main import generate_response
+from application.auth.routes import auth_token_required
+
+# Accepted values for the match parameter
+MATCH_MODES = ("all", "any")
+
+
+@app.route("/therapists", methods=["GET"])
+@auth_token_required
+def search_therapists():
+    """Search therapists by name and specialism.
+
+    URL
+    ----------
+    GET /therapists
+
+    Query Parameters
+    ----------
+    name :
+        Matched against the start of each word in the therapist's name.
+    fuzzy :
+        If true, match names by similarity instead, best match first.
+    specialisms :
+        A comma separated list of therapist specialisms.
+    match :
+        all (the default) to require every specialism, any to require one.
+    page :
+        The page of results to return, starting at 1.
+    per_page :
+        The number of results per page.
+
+    Response
+    -------
+    400 :
+        Invalid match mode or page.
+    200 :
+          Therapists found: {int}
+          Example :
+            {
+                "message": "Therapists found: 1",
+                "therapists": [
+                    {
+                        "id": 1,
+                        "name": "John Smith",
+                        "specialisms": ["Addiction", "CBT"],
+                    },
+                ],
+                "page": 1,
+                "more": false,
+            }
+
+    """
+    args = request.args
+    match = args.get("match", "all")
+    if match not in MATCH_MODES:
+        return generate_response(
+            f"Incorrect match. Must be one of {list(MATCH_MODES)}", 400
+        )
+    try:
+        page = int(args.get("page", 1))
+        per_page = int(args.get("per_page", app.config.get("SEARCH_PAGE_SIZE")))
+        if page < 1 or not 1 <= per_page <= app.config.get("SEARCH_MAX_PAGE_SIZE"):
+            raise ValueError
+    except ValueError:
+        return generate_response("Invalid page or page size.", 400)
+
+    therapists, more = Therapist.search(
+        name=args.get("name"),
+        specialisms=args.get("specialisms", "").split(","),
+        match_all=match == "all",
+        fuzzy=args.get("fuzzy", "").lower() in ("1", "true", "yes"),
+        page=page,
+        per_page=per_page,
+    )
+    return generate_response(
+        f"Therapists found: {len(therapists)}",
+        200,
+        therapists=therapists,
+        page=page,
+        more=more,
+    )
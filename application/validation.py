@@ -0,0 +1,73 @@
+import json
+import re
+from datetime import datetime
+from flask import request
+
+from application.main import generate_response
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M"
+# The zero padded form of DATETIME_FORMAT, which fromisoformat parses the same
+CANONICAL_DATETIME = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}", re.ASCII)
+
+
+class Schema(object):
+    """Precompiled description of the arguments an endpoint accepts.
+
+    Built once at import time so each request only does set operations.
+    """
+
+    def __init__(self, required, types=None, exact=False):
+        self.required = frozenset(required)
+        self.types = tuple((types or {}).items())
+        self.exact = exact
+
+    def missing(self, args):
+        """True if required arguments are missing or, for exact schemas, extras sent."""
+        if self.exact and len(args) != len(self.required):
+            return True
+        return not self.required.issubset(args)
+
+    def wrong_type(self, args):
+        """True if any argument is not of the type the schema expects."""
+        for key, expected in self.types:
+            if key in args and not isinstance(args[key], expected):
+                return True
+        return False
+
+
+def parse_datetime(value):
+    """Parse a "YYYY-MM-DD HH:MM" string.
+
+    Uses the C ISO parser for the canonical, zero padded form and falls back
+    to strptime for anything else strptime would accept. Newer Pythons' ISO
+    parser also takes forms strptime rejects, e.g. "2022-W25-1 12:41" or
+    "2030-06-20 1241Z", so only strings matching the exact pattern go to it.
+    """
+    if CANONICAL_DATETIME.fullmatch(value):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    return datetime.strptime(value, DATETIME_FORMAT)
+
+
+def get_args(data):
+    try:
+        # Data could be an already parsed dict or a json string
+        if isinstance(data, str):
+            return json.loads(data)
+        else:
+            return data
+    except TypeError:
+        return generate_response(f"Invalid JSON data supplied.", 400)
+    except json.decoder.JSONDecodeError:
+        return generate_response(f"Invalid JSON data supplied.", 400)
+
+
+def json_args():
+    """Parse the JSON body once per request, however many times it is asked for."""
+    # Cached on the request rather than g, as an app context (and so g) can
+    # outlive a single request, e.g. in the CLI or tests.
+    if not hasattr(request, "json_args"):
+        request.json_args = get_args(request.json)
+    return request.json_args
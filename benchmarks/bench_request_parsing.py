@@ -0,0 +1,80 @@
+"""Micro-benchmarks for the per-request parsing done by the route handlers.
+
+Compares the inline parsing the routes used to do with the helpers in
+application/validation.py. Run from the repository root with:
+
+    APPLICATION_STAGE=test python -m benchmarks.bench_request_parsing
+"""
+
+import timeit
+from datetime import datetime
+
+from wsgi import app
+from application.appointments.routes import NEW_APPOINTMENT, VALID_TYPES
+from application.auth.routes import CREDENTIALS
+from application.validation import parse_datetime
+from models.appointment import Appointment
+
+NUMBER = 200000
+
+credentials = {"email": "test@example.com", "password": "test_password"}
+appointment = {
+    "start": "2022-06-20 12:41",
+    "duration": "60",
+    "type": "consultation",
+    "therapist_id": "1",
+}
+
+
+def old_credentials():
+    return list(credentials.keys()) != ["email", "password"] or (
+        not isinstance(credentials["email"], str)
+        or not isinstance(credentials["password"], str)
+    )
+
+
+def new_credentials():
+    return CREDENTIALS.missing(credentials) or CREDENTIALS.wrong_type(credentials)
+
+
+def old_appointment_keys():
+    keys = appointment.keys()
+    return (
+        "start" not in keys
+        or "duration" not in keys
+        or "type" not in keys
+        or "therapist_id" not in keys
+    )
+
+
+def new_appointment_keys():
+    return NEW_APPOINTMENT.missing(appointment)
+
+
+CASES = [
+    ("credentials check", old_credentials, new_credentials),
+    ("appointment keys", old_appointment_keys, new_appointment_keys),
+    (
+        "type membership",
+        lambda: appointment["type"] not in Appointment.types(),
+        lambda: appointment["type"] not in VALID_TYPES,
+    ),
+    (
+        "start datetime",
+        lambda: datetime.strptime(appointment["start"], "%Y-%m-%d %H:%M"),
+        lambda: parse_datetime(appointment["start"]),
+    ),
+]
+
+
+def main():
+    with app.app_context():
+        print(f"{'case':<20}{'before (us)':>14}{'after (us)':>14}{'speedup':>10}")
+        for name, before, after in CASES:
+            old = min(timeit.repeat(before, number=NUMBER, repeat=3)) / NUMBER
+            new = min(timeit.repeat(after, number=NUMBER, repeat=3)) / NUMBER
+            print(f"{name:<20}{old * 1e6:>14.3f}{new * 1e6:>14.3f}{old / new:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import json
 import os
 
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -11,19 +12,96 @@ class Config(object):
     CSRF_ENABLED = True
     SECRET = os.getenv("SECRET")
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    REFRESH_TOKEN_DAYS = 30
+    # Clinics with their own database, as a JSON object of clinic id to URL.
+    # Any other clinic is served from SQLALCHEMY_DATABASE_URI.
+    TENANT_DATABASES = json.loads(os.environ.get("TENANT_DATABASES") or "{}")
+    # Clinic joined by users registering through /register. Members of other
+    # clinics are added with manage.py add_user.
+    REGISTRATION_CLINIC = os.getenv("REGISTRATION_CLINIC")
+    TENANT_HEADER = "X-Clinic-Id"
     SQLALCHEMY_DATABASE_URI = os.environ.get(
         "DATABASE_URL"
     ) or "sqlite:///" + os.path.join(basedir, "app.db")
+    # Logging. With LOG_ASYNC, records are written by a background thread
+    # through a queue of LOG_QUEUE_SIZE, dropping records when it is full.
+    # At most LOG_SAMPLE_BURST copies of a message are logged per window.
+    LOG_ASYNC = True
+    LOG_QUEUE_SIZE = 10000
+    LOG_SAMPLE_WINDOW_SECONDS = 1.0
+    LOG_SAMPLE_BURST = 20
+    # Request profiling. When enabled, requests sending PROFILING_TOKEN in the
+    # PROFILING_HEADER header, plus a PROFILING_SAMPLE_RATE fraction of all
+    # requests, are profiled. PROFILING_MODE "cprofile" writes pstats files
+    # and "sampler" writes collapsed stacks for flame graphs.
+    PROFILING_ENABLED = os.getenv("PROFILING_ENABLED") == "1"
+    PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+    PROFILING_HEADER = "X-Profile"
+    PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE") or 0)
+    PROFILING_MODE = os.getenv("PROFILING_MODE") or "cprofile"
+    PROFILING_SAMPLE_INTERVAL = 0.001
+    PROFILING_DIR = os.getenv("PROFILING_DIR") or os.path.join(basedir, "profiles")
+    # Time budgets in seconds per endpoint, applied to database work as a
+    # statement_timeout (Postgres) or progress handler (SQLite). Requests over
+    # budget get a 503, well before uWSGI's harakiri kills the worker.
+    DEFAULT_ROUTE_TIMEOUT = 30
+    ROUTE_TIMEOUTS = {
+        "get_appointments": 10,
+        "add_appointment": 5,
+        "sync_appointments": 10,
+        "batch_appointments": 10,
+        "stats": 10,
+        "search_therapists": 5,
+        "login": 5,
+        "register": 5,
+    }
+    # Background jobs
+    JOBS_SYNCHRONOUS = False
+    JOB_MAX_ATTEMPTS = 5
+    JOB_BACKOFF_SECONDS = 2
+    JOB_BACKOFF_MAX_SECONDS = 600
+    JOB_LEASE_SECONDS = 300
+    # Appointment event feed
+    EVENTS_CHANNEL = "appointment_events"
+    EVENTS_BUFFER_SIZE = 100
+    EVENTS_HEARTBEAT_SECONDS = 15
+    # Streams are closed after this long, which must stay well under uwsgi's
+    # harakiri timeout. Clients are told to reconnect after EVENTS_RETRY_SECONDS.
+    EVENTS_STREAM_SECONDS = 30
+    EVENTS_RETRY_SECONDS = 1
+    # Most filter sets accepted by one /batch_appointments call
+    BATCH_MAX_QUERIES = 25
+    # Most change log entries returned by one /sync_appointments call
+    SYNC_PAGE_SIZE = 500
+    # Idempotency-Key handling for /add_appointment
+    IDEMPOTENCY_HEADER = "Idempotency-Key"
+    IDEMPOTENCY_TTL_SECONDS = 86400
+    # In-flight keys older than this are assumed abandoned and can be retaken
+    IDEMPOTENCY_LOCK_SECONDS = 60
+    IDEMPOTENCY_WAIT_SECONDS = 10
+    IDEMPOTENCY_POLL_SECONDS = 0.05
+    # Therapist search
+    SEARCH_PAGE_SIZE = 20
+    SEARCH_MAX_PAGE_SIZE = 100
+    SEARCH_FUZZY_THRESHOLD = 0.3
+    SEARCH_CACHE_SIZE = 1024
+    SEARCH_CACHE_SECONDS = 60
 
 
 class DevConfig(Config):
     SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(basedir, "dev", "app.db")
+    LOG_SAMPLE_BURST = None
 
 
 class TestConfig(Config):
     TESTING = True
     SECRET = "test"
-    SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(basedir, "test.db")
+    JOBS_SYNCHRONOUS = True
+    LOG_ASYNC = False
+    # In memory, so every test process gets its own database
+    SQLALCHEMY_DATABASE_URI = "sqlite://"
+    # A single iteration keeps password hashing out of test run times
+    PASSWORD_HASH_METHOD = "pbkdf2:sha256:1"
 
 
 class ProdConfig(Config):
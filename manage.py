@@ -1,11 +1,22 @@
 import os
+import sys
 import unittest
 
+import click
+from flask import g
 from flask.cli import FlaskGroup
+from sqlalchemy import create_engine
 
-from application import create_app, db
-from tests import test_appointments, test_auth, create_dummy_data
-
+from application import create_app, db, jobs, tenancy
+from models.appointment_change import AppointmentChange
+from models.appointment_stat import AppointmentStat
+from models.idempotency_key import IdempotencyKey
+from models.refresh_token import RefreshToken
+from models.user import User
+from tests import test_appointments, test_auth, test_batch, test_deadlines, test_events
+from tests import test_idempotency, test_jobs, test_logs
+from tests import test_profiling, test_search, test_stats, test_sync, test_tenancy
+from tests import create_dummy_data, runner
 
 app = create_app(os.getenv("APPLICATION_STAGE"))
 
@@ -16,6 +27,11 @@ cli = FlaskGroup(app)
 def create_db():
     db.drop_all()
     db.create_all()
+    # Clinics on their own shard need the full schema there too
+    for clinic_id in app.config["TENANT_DATABASES"]:
+        engine = tenancy.engine_for(clinic_id, db)
+        db.Model.metadata.drop_all(engine)
+        db.Model.metadata.create_all(engine)
     db.session.commit()
 
 
@@ -24,8 +40,72 @@ def seed_db():
     create_dummy_data.insert_dummy_data(app)
 
 
+@cli.command("add_user")
+@click.argument("email")
+@click.option("--clinic", default=None, help="Clinic the user belongs to.")
+@click.password_option()
+def add_user(email, clinic, password):
+    """Add a user to a clinic, on the clinic's own database if it has one."""
+    g.clinic_id = clinic
+    user = User(email, clinic)
+    user.set_password(password)
+    user.save()
+    print(f"Added user {email} to clinic {clinic}.")
+
+
+@cli.command("prune_tokens")
+def prune_tokens():
+    print(f"Pruned {RefreshToken.prune()} expired refresh tokens.")
+
+
+@cli.command("prune_idempotency_keys")
+def prune_idempotency_keys():
+    print(f"Pruned {IdempotencyKey.prune()} expired idempotency keys.")
+
+
+@cli.command("compact_changes")
+def compact_changes():
+    print(f"Removed {AppointmentChange.compact()} superseded appointment changes.")
+
+
+@cli.command("rebuild_stats")
+@click.option("--clinic", default=None, help="Only rebuild this clinic's stats.")
+def rebuild_stats(clinic):
+    g.clinic_id = clinic
+    print(f"Rebuilt {AppointmentStat.rebuild(clinic)} daily stats rows.")
+
+
+@cli.command("worker")
+@click.option("--batch-size", default=10, help="Jobs to claim per poll.")
+@click.option("--idle-sleep", default=1.0, help="Seconds to wait when idle.")
+@click.option("--once", is_flag=True, help="Exit once the queue is empty.")
+@click.option("--clinic", default=None, help="Work the queue on this clinic's shard.")
+def worker(batch_size, idle_sleep, once, clinic):
+    g.clinic_id = clinic
+    jobs.work(batch_size=batch_size, idle_sleep=idle_sleep, once=once)
+
+
+@cli.command("move_tenant")
+@click.argument("clinic_id")
+@click.argument("target_url")
+def move_tenant(clinic_id, target_url):
+    """Move a clinic's data from its current database to TARGET_URL.
+
+    Add the clinic to TENANT_DATABASES (or remove it, if moving back to the
+    default database) once the move has finished.
+    """
+    counts = tenancy.move_tenant(
+        clinic_id,
+        tenancy.engine_for(clinic_id, db),
+        create_engine(target_url),
+        db.Model.metadata,
+    )
+    print(f"Moved clinic {clinic_id}: {counts}")
+
+
 @cli.command("test")
-def test():
+@click.option("--workers", default=1, help="Processes to run the tests across.")
+def test(workers):
     # Initialize the test suite
     loader = unittest.TestLoader()
     suite = unittest.TestSuite()
@@ -33,10 +113,24 @@ def test():
     # Add tests to the test suite
     suite.addTests(loader.loadTestsFromModule(test_appointments))
     suite.addTests(loader.loadTestsFromModule(test_auth))
+    suite.addTests(loader.loadTestsFromModule(test_batch))
+    suite.addTests(loader.loadTestsFromModule(test_deadlines))
+    suite.addTests(loader.loadTestsFromModule(test_events))
+    suite.addTests(loader.loadTestsFromModule(test_idempotency))
+    suite.addTests(loader.loadTestsFromModule(test_jobs))
+    suite.addTests(loader.loadTestsFromModule(test_logs))
+    suite.addTests(loader.loadTestsFromModule(test_profiling))
+    suite.addTests(loader.loadTestsFromModule(test_search))
+    suite.addTests(loader.loadTestsFromModule(test_stats))
+    suite.addTests(loader.loadTestsFromModule(test_sync))
+    suite.addTests(loader.loadTestsFromModule(test_tenancy))
 
-    # Run the suite
-    runner = unittest.TextTestRunner(verbosity=3)
-    runner.run(suite)
+    # Run the suite, exiting non-zero on failure so CI notices
+    if workers > 1:
+        passed = runner.run_parallel(suite, workers)
+    else:
+        passed = unittest.TextTestRunner(verbosity=3).run(suite).wasSuccessful()
+    sys.exit(0 if passed else 1)
 
 
 if __name__ == "__main__":
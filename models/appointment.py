@@ -1,8 +1,13 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from flask import current_app as app
 
-from application import db
+from application import db, events, jobs
 from .therapist import Therapist
+from .appointment_change import AppointmentChange
+from .appointment_stat import AppointmentStat
+
+# Valid appointment types, in the order they are listed to clients
+APPOINTMENT_TYPES = ("one-off", "consultation")
 
 
 class Appointment(db.Model):
@@ -17,6 +22,7 @@ class Appointment(db.Model):
     client = db.relationship("User", back_populates="appointments")
     therapist_id = db.Column(db.Integer, db.ForeignKey("therapists.id"))
     therapist = db.relationship("Therapist", back_populates="appointments")
+    clinic_id = db.Column(db.String(64), index=True)
 
     def __init__(self, datetime, length, appointment_type, therapist, client=None):
         self.start_datetime = datetime
@@ -24,11 +30,17 @@ class Appointment(db.Model):
         self.appointment_type = appointment_type
         self.client = client
         self.therapist = therapist
+        self.clinic_id = therapist.clinic_id
+        # Not a column. Assigning the therapist can autoflush this instance,
+        # so the session can't be relied on to say whether it is new.
+        self._unsaved = True
 
     def save(self):
         # Don't want to be able to add appointments in the past
         if self.start_datetime < datetime.now():
             return "Cannot add an appointment in the past."
+        AppointmentChange.lock(self.clinic_id)
+        change = "insert" if getattr(self, "_unsaved", False) else "update"
 
         therapist = Therapist.query.filter_by(id=self.therapist.id).first()
         # Find if the therapist already has an appointment at the requested time.
@@ -42,10 +54,32 @@ class Appointment(db.Model):
         )
         if not overlap:
             db.session.add(self)
+            db.session.flush()
+            db.session.add(AppointmentChange(self, change))
+            job = jobs.enqueue("appointment_booked", appointment_id=self.id)
+            events.announce(self, change)
             db.session.commit()
+            self._unsaved = False
+            jobs.dispatch(job)
             return "Appointment added."
         return "Overlapping with existing appointment."
 
+    def delete(self):
+        AppointmentChange.lock(self.clinic_id)
+        db.session.add(AppointmentChange(self, "delete"))
+        events.announce(self, "delete")
+        db.session.delete(self)
+        db.session.commit()
+
+    def to_dict(self):
+        return {
+            "time": self.start_datetime,
+            "duration": (self.end_datetime - self.start_datetime)
+            / timedelta(minutes=1),
+            "therapist": self.therapist.name,
+            "type": self.appointment_type,
+        }
+
     @staticmethod
     def types():
-        return ["one-off", "consultation"]
+        return list(APPOINTMENT_TYPES)
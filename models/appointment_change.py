@@ -0,0 +1,101 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+from application import db
+
+# Postgres advisory lock key serialising each clinic's writes to the change log
+CHANGE_LOG_LOCK = 7140203
+
+
+class AppointmentChange(db.Model):
+    """Class defining the schema for the appointment change log.
+
+    Every change made through Appointment.save or Appointment.delete appends
+    a row. The autoincrementing seq gives each change a position in a single,
+    monotonic sequence, which clients use as their sync token.
+
+    seq is assigned on insert, not on commit, so writers must call lock()
+    first. Otherwise a change could commit after a later one, behind a sync
+    token a client already holds, and never be sent to it. Clients only
+    follow their own clinic's changes, so the order only has to hold within
+    a clinic.
+
+    Moving a clinic to another database logs a "reset" change for it there
+    (see tenancy.move_tenant). Tokens from before that can't be followed,
+    so get a full resync.
+    """
+
+    __tablename__ = "appointment_changes"
+    seq = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    appointment_id = db.Column(db.Integer, index=True)
+    change = db.Column(db.String(10))
+    clinic_id = db.Column(db.String(64), index=True)
+    changed_at = db.Column(db.DateTime)
+
+    def __init__(self, appointment, change):
+        self.appointment_id = appointment.id
+        self.change = change
+        self.clinic_id = appointment.clinic_id
+        self.changed_at = datetime.utcnow()
+
+    @staticmethod
+    def lock(clinic_id):
+        """Hold clinic_id's change log until this transaction ends.
+
+        The clinic's changes then commit in seq order. Take it before writing
+        anything else in the transaction, so writers can't deadlock on other
+        rows. SQLite only has one writer at a time, so needs nothing more.
+        """
+        session = db.session()
+        bind = session.get_bind(mapper=AppointmentChange.__mapper__)
+        if bind.dialect.name == "postgresql":
+            session.execute(
+                text(
+                    "SELECT pg_advisory_xact_lock(:key, hashtext(coalesce(:clinic, '')))"
+                ),
+                {"key": CHANGE_LOG_LOCK, "clinic": clinic_id},
+            )
+
+    @staticmethod
+    def latest(clinic_id):
+        """The current sync token for clinic_id, i.e. the seq of its last change.
+
+        Other clinics' changes aren't ordered against this one's, so a later
+        seq from them could commit before an earlier one from this clinic.
+        """
+        query = db.session.query(db.func.max(AppointmentChange.seq))
+        return query.filter_by(clinic_id=clinic_id).scalar() or 0
+
+    @staticmethod
+    def since(token, clinic_id, limit=None):
+        """Changes to clinic_id's appointments after token, oldest first."""
+        query = AppointmentChange.query.filter(AppointmentChange.seq > token).filter_by(
+            clinic_id=clinic_id
+        )
+        return query.order_by(AppointmentChange.seq).limit(limit).all()
+
+    @staticmethod
+    def reset_since(token, clinic_id):
+        """True if clinic_id has been moved here from another database since token."""
+        query = AppointmentChange.query.filter(AppointmentChange.seq > token)
+        return db.session.query(
+            query.filter_by(clinic_id=clinic_id, change="reset").exists()
+        ).scalar()
+
+    @staticmethod
+    def compact():
+        """Delete every change superseded by a later one for the same appointment.
+
+        Syncing only ever needs the latest change per appointment, so this
+        never changes what a client is sent.
+        """
+        # Reset markers have no appointment, so keep the latest per clinic
+        latest = db.session.query(db.func.max(AppointmentChange.seq)).group_by(
+            AppointmentChange.appointment_id, AppointmentChange.clinic_id
+        )
+        count = AppointmentChange.query.filter(
+            AppointmentChange.seq.notin_(latest.scalar_subquery())
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return count
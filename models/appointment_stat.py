@@ -0,0 +1,169 @@
+from collections import Counter
+from datetime import timedelta
+
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+
+from application import db
+
+
+def minutes(start, end):
+    return int((end - start) / timedelta(minutes=1))
+
+
+class AppointmentStat(db.Model):
+    """Class defining the schema for the daily appointment rollup.
+
+    One row per day, therapist and appointment type, holding the minutes
+    booked and the number of appointments. Rows are kept up to date as
+    appointments are flushed, so reading stats never touches appointments.
+    """
+
+    __tablename__ = "appointment_stats"
+    day = db.Column(db.Date, primary_key=True)
+    therapist_id = db.Column(db.Integer, primary_key=True)
+    appointment_type = db.Column(db.String(120), primary_key=True)
+    clinic_id = db.Column(db.String(64), index=True)
+    minutes = db.Column(db.Integer, nullable=False, default=0)
+    slots = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def key(start, end, appointment_type, therapist_id, clinic_id):
+        """The row an appointment counts towards, and what it adds to it."""
+        return (start.date(), therapist_id, appointment_type, clinic_id), minutes(
+            start, end
+        )
+
+    @staticmethod
+    def apply(session, deltas):
+        """Add each (minutes, slots) delta to its row.
+
+        Rows are upserted, so concurrent bookings for a new row can't both
+        try to insert it, and removed once no appointments are left in them.
+        """
+        table = AppointmentStat.__table__
+        dialect = session.get_bind(mapper=AppointmentStat.__mapper__).dialect.name
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        for key, (added, slots) in deltas.items():
+            if not added and not slots:
+                continue
+            day, therapist_id, appointment_type, clinic_id = key
+            statement = insert(table).values(
+                day=day,
+                therapist_id=therapist_id,
+                appointment_type=appointment_type,
+                clinic_id=clinic_id,
+                minutes=added,
+                slots=slots,
+            )
+            session.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[
+                        table.c.day,
+                        table.c.therapist_id,
+                        table.c.appointment_type,
+                    ],
+                    set_={
+                        "minutes": table.c.minutes + statement.excluded.minutes,
+                        "slots": table.c.slots + statement.excluded.slots,
+                    },
+                )
+            )
+            if slots < 0:
+                session.execute(
+                    table.delete().where(
+                        table.c.day == day,
+                        table.c.therapist_id == therapist_id,
+                        table.c.appointment_type == appointment_type,
+                        table.c.slots <= 0,
+                    )
+                )
+
+    @staticmethod
+    def rebuild(clinic_id=None):
+        """Recompute the rollup from the appointments table.
+
+        Returns the number of rows written.
+        """
+        from .appointment import Appointment
+
+        stats = AppointmentStat.query
+        appointments = db.session.query(
+            Appointment.start_datetime,
+            Appointment.end_datetime,
+            Appointment.appointment_type,
+            Appointment.therapist_id,
+            Appointment.clinic_id,
+        )
+        if clinic_id is not None:
+            stats = stats.filter_by(clinic_id=clinic_id)
+            appointments = appointments.filter_by(clinic_id=clinic_id)
+        stats.delete(synchronize_session=False)
+
+        totals = Counter()
+        slots = Counter()
+        for row in appointments.yield_per(1000):
+            key, booked = AppointmentStat.key(*row)
+            totals[key] += booked
+            slots[key] += 1
+        AppointmentStat.apply(db.session(), {k: (totals[k], slots[k]) for k in slots})
+        db.session.commit()
+        return len(slots)
+
+
+def history_value(state, name):
+    """The value an attribute had before the pending changes to it."""
+    history = state.attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return state.attrs[name].value
+
+
+def appointment_key(state, previous=False):
+    value = history_value if previous else lambda s, n: s.attrs[n].value
+    return AppointmentStat.key(
+        *(
+            value(state, name)
+            for name in (
+                "start_datetime",
+                "end_datetime",
+                "appointment_type",
+                "therapist_id",
+                "clinic_id",
+            )
+        )
+    )
+
+
+@event.listens_for(SignallingSession, "after_flush")
+def update_stats(session, flush_context):
+    """Fold the appointments just flushed into the daily rollup.
+
+    Updates move the appointment out of the row it was counted in and into
+    its new one. Unchanged appointments cancel out and are skipped.
+    """
+    from .appointment import Appointment
+
+    deltas = {}
+
+    def add(key, booked, slots):
+        total, count = deltas.get(key, (0, 0))
+        deltas[key] = (total + booked * slots, count + slots)
+
+    for instance in session.new:
+        if isinstance(instance, Appointment):
+            add(*appointment_key(db.inspect(instance)), 1)
+    for instance in session.dirty:
+        if isinstance(instance, Appointment):
+            state = db.inspect(instance)
+            add(*appointment_key(state, previous=True), -1)
+            add(*appointment_key(state), 1)
+    for instance in session.deleted:
+        if isinstance(instance, Appointment):
+            add(*appointment_key(db.inspect(instance), previous=True), -1)
+
+    if deltas:
+        AppointmentStat.apply(session, deltas)
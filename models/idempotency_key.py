@@ -0,0 +1,118 @@
+import hashlib
+
+from datetime import datetime, timedelta
+from flask import current_app as app
+from sqlalchemy import exc
+
+from application import db
+
+
+class IdempotencyKey(db.Model):
+    """Class defining the schema for the idempotency keys table.
+
+    Holds the response to each request sent with an Idempotency-Key, so a
+    retry can be answered without running it again. A row without a
+    status_code belongs to a request that is still in flight.
+    """
+
+    __tablename__ = "idempotency_keys"
+    key_hash = db.Column(db.String(64), primary_key=True)
+    fingerprint = db.Column(db.String(64))
+    status_code = db.Column(db.Integer)
+    body = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime, index=True)
+
+    def __init__(self, key_hash, fingerprint):
+        self.key_hash = key_hash
+        self.fingerprint = fingerprint
+        self.created_at = datetime.utcnow()
+        self.expires_at = self.created_at + timedelta(
+            seconds=app.config.get("IDEMPOTENCY_TTL_SECONDS")
+        )
+
+    @staticmethod
+    def hash(user_id, key):
+        """Keys are only unique per user, so both go into the stored hash."""
+        return hashlib.sha256(f"{user_id}:{key}".encode()).hexdigest()
+
+    @staticmethod
+    def claim(key_hash, fingerprint):
+        """Try to take key_hash for a new request.
+
+        Returns the row and whether it was claimed. An unclaimed row is
+        either finished or still in flight. Expired rows, and in-flight rows
+        older than IDEMPOTENCY_LOCK_SECONDS (left by a crashed worker), are
+        taken over.
+        """
+        for _ in range(3):
+            db.session.add(IdempotencyKey(key_hash, fingerprint))
+            try:
+                db.session.commit()
+                return IdempotencyKey.query.get(key_hash), True
+            except exc.IntegrityError:
+                db.session.rollback()
+
+            existing = IdempotencyKey.query.get(key_hash)
+            if existing is None:
+                # Released since the insert failed, so try again
+                continue
+            now = datetime.utcnow()
+            stale = now - timedelta(seconds=app.config.get("IDEMPOTENCY_LOCK_SECONDS"))
+            if existing.expires_at >= now and (
+                existing.status_code is not None or existing.created_at >= stale
+            ):
+                return existing, False
+            # Only one of several requests finding it abandoned gets it
+            replacement = IdempotencyKey(key_hash, fingerprint)
+            taken = IdempotencyKey.query.filter_by(
+                key_hash=key_hash, created_at=existing.created_at
+            ).update(
+                {
+                    "fingerprint": replacement.fingerprint,
+                    "status_code": None,
+                    "body": None,
+                    "created_at": replacement.created_at,
+                    "expires_at": replacement.expires_at,
+                },
+                synchronize_session=False,
+            )
+            db.session.commit()
+            existing = IdempotencyKey.query.populate_existing().get(key_hash)
+            if taken:
+                return existing, True
+            if existing is not None:
+                return existing, False
+        return None, False
+
+    @staticmethod
+    def complete(key_hash, status_code, body):
+        """Store the response to the request holding key_hash.
+
+        Only successful requests keep their work. Anything a rejected request
+        left in the session is rolled back rather than committed with it.
+        """
+        if not 200 <= status_code < 300:
+            db.session.rollback()
+        IdempotencyKey.query.filter_by(key_hash=key_hash).update(
+            {"status_code": status_code, "body": body}, synchronize_session=False
+        )
+        db.session.commit()
+
+    @staticmethod
+    def release(key_hash):
+        """Give up key_hash, so the request can be retried."""
+        db.session.rollback()
+        IdempotencyKey.query.filter_by(key_hash=key_hash).delete(
+            synchronize_session=False
+        )
+        db.session.commit()
+
+    @staticmethod
+    def prune():
+        """Delete expired keys."""
+        count = IdempotencyKey.query.filter(
+            IdempotencyKey.expires_at < datetime.utcnow()
+        ).delete()
+        db.session.commit()
+        return count
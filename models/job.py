@@ -0,0 +1,36 @@
+import json
+from datetime import datetime
+
+from application import db
+
+
+class Job(db.Model):
+    """Class defining the schema for the background jobs table"""
+
+    __tablename__ = "jobs"
+    __table_args__ = (db.Index("ix_jobs_status_run_at", "status", "run_at"),)
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120))
+    payload = db.Column(db.Text)
+    status = db.Column(db.String(20), default="queued")
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer)
+    run_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return "Job {0}: {1} ({2})".format(self.id, self.name, self.status)
+
+    def __init__(self, name, payload, max_attempts):
+        self.name = name
+        self.payload = json.dumps(payload)
+        self.status = "queued"
+        self.attempts = 0
+        self.max_attempts = max_attempts
+        self.created_at = datetime.utcnow()
+        self.run_at = self.created_at
+
+    @property
+    def kwargs(self):
+        return json.loads(self.payload)
@@ -0,0 +1,96 @@
+import hashlib
+import secrets
+
+from datetime import datetime, timedelta
+from flask import current_app as app
+
+from application import db
+
+
+class RefreshToken(db.Model):
+    """Class defining the schema for the refresh tokens table.
+
+    Only a SHA-256 hash of each token is stored. Refresh tokens are long,
+    random values, so a fast hash is enough here and keeps /refresh cheap
+    compared to the password hashing done by /login.
+    """
+
+    __tablename__ = "refresh_tokens"
+    token_hash = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("users.id"), index=True)
+    user = db.relationship("User")
+    family = db.Column(db.String(32), index=True)
+    expires_at = db.Column(db.DateTime)
+    revoked = db.Column(db.Boolean, default=False)
+
+    def __init__(self, token, user, family):
+        self.token_hash = RefreshToken.hash(token)
+        self.user = user
+        self.family = family
+        self.expires_at = datetime.utcnow() + timedelta(
+            days=app.config.get("REFRESH_TOKEN_DAYS")
+        )
+        self.revoked = False
+
+    @staticmethod
+    def hash(token):
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @staticmethod
+    def issue(user, family=None):
+        """Create a new refresh token for user, returning the raw token."""
+        token = secrets.token_urlsafe(32)
+        db.session.add(RefreshToken(token, user, family or secrets.token_hex(16)))
+        return token
+
+    @staticmethod
+    def rotate(token):
+        """Exchange a refresh token for a new one.
+
+        Returns the user and new token, or an error string. Presenting a token
+        that has already been rotated means it has leaked, so every token in
+        its family is revoked.
+        """
+        refresh_token = RefreshToken.query.get(RefreshToken.hash(token))
+        if refresh_token is None:
+            return None, "Invalid refresh token. Please login."
+        if refresh_token.revoked:
+            RefreshToken.query.filter_by(family=refresh_token.family).update(
+                {"revoked": True}
+            )
+            db.session.commit()
+            return None, "Revoked refresh token. Please login."
+        if refresh_token.expires_at < datetime.utcnow():
+            return None, "Expired refresh token. Please login."
+        # Claim the token with a conditional update, so only one of several
+        # concurrent requests presenting it gets a new token
+        claimed = RefreshToken.query.filter_by(
+            token_hash=refresh_token.token_hash, revoked=False
+        ).update({"revoked": True}, synchronize_session=False)
+        if claimed != 1:
+            db.session.rollback()
+            return None, "Revoked refresh token. Please login."
+        new_token = RefreshToken.issue(refresh_token.user, refresh_token.family)
+        db.session.commit()
+        return refresh_token.user, new_token
+
+    @staticmethod
+    def revoke(token):
+        """Revoke a refresh token and every token rotated from it."""
+        refresh_token = RefreshToken.query.get(RefreshToken.hash(token))
+        if refresh_token is None:
+            return False
+        RefreshToken.query.filter_by(family=refresh_token.family).update(
+            {"revoked": True}
+        )
+        db.session.commit()
+        return True
+
+    @staticmethod
+    def prune():
+        """Delete expired tokens, keeping the revoked list small."""
+        count = RefreshToken.query.filter(
+            RefreshToken.expires_at < datetime.utcnow()
+        ).delete()
+        db.session.commit()
+        return count
@@ -1,6 +1,10 @@
+import sqlite3
+
 from flask import current_app as app
+from sqlalchemy import DDL, event
+from sqlalchemy.orm import selectinload
 
-from application import db
+from application import db, search, tenancy
 
 # Many-To-Many association
 mtm_assoc = db.Table(
@@ -8,6 +12,8 @@ mtm_assoc = db.Table(
     db.Column("therapist_id", db.ForeignKey("therapists.id"), primary_key=True),
     db.Column("specialism_id", db.ForeignKey("specialism.id"), primary_key=True),
 )
+# The primary key only covers lookups by therapist
+db.Index("ix_therapist_specialisms_specialism_id", mtm_assoc.c.specialism_id)
 
 
 class Therapist(db.Model):
@@ -16,17 +22,158 @@ class Therapist(db.Model):
     __tablename__ = "therapists"
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120))
+    clinic_id = db.Column(db.String(64), index=True)
     appointments = db.relationship("Appointment", back_populates="therapist")
     specialisms = db.relationship(
         "Specialism", secondary=mtm_assoc, back_populates="therapists"
     )
 
-    def __init__(self, name):
+    def __init__(self, name, clinic_id=None):
         self.name = name
+        self.clinic_id = clinic_id
 
     def save(self):
         db.session.add(self)
         db.session.commit()
+        search.cache.clear()
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "specialisms": sorted(x.name for x in self.specialisms),
+        }
+
+    @staticmethod
+    def search(
+        name=None, specialisms=(), match_all=True, fuzzy=False, page=1, per_page=20
+    ):
+        """Find therapists in the current clinic by name and specialism.
+
+        Names match on the start of any word, or with fuzzy set, on trigram
+        similarity, best match first. Therapists must have every one of
+        specialisms, or with match_all unset, any of them. Results are cached
+        per normalised query until a therapist or specialism is saved.
+
+        Returns a page of therapist dicts, and whether there are more pages.
+        """
+        name = search.normalise(name)
+        specialisms = sorted({x.strip() for x in specialisms if x.strip()})
+        key = (
+            tenancy.current_clinic(),
+            name,
+            tuple(specialisms),
+            match_all,
+            fuzzy,
+            page,
+            per_page,
+        )
+        cached = search.cache.get(key)
+        if cached is not None:
+            return cached
+        generation = search.cache.generation
+
+        query = Therapist.scoped().options(selectinload(Therapist.specialisms))
+        if specialisms:
+            matching = (
+                db.session.query(mtm_assoc.c.therapist_id)
+                .join(Specialism, Specialism.id == mtm_assoc.c.specialism_id)
+                .filter(Specialism.name.in_(specialisms))
+            )
+            if match_all:
+                matching = matching.group_by(mtm_assoc.c.therapist_id).having(
+                    db.func.count() == len(specialisms)
+                )
+            query = query.filter(Therapist.id.in_(matching.scalar_subquery()))
+
+        dialect = db.session().get_bind(mapper=Therapist.__mapper__).dialect.name
+        offset = (page - 1) * per_page
+        # Trigrams need at least three characters
+        if name and fuzzy and len(name) >= 3:
+            threshold = app.config.get("SEARCH_FUZZY_THRESHOLD")
+            if dialect == "postgresql":
+                # % narrows the candidates using the trigram index
+                lowered = db.func.lower(Therapist.name)
+                score = db.func.similarity(lowered, name)
+                rows = (
+                    query.filter(lowered.op("%")(name), score >= threshold)
+                    .order_by(score.desc(), Therapist.name, Therapist.id)
+                    .offset(offset)
+                    .limit(per_page + 1)
+                    .all()
+                )
+            else:
+                # Anything sharing a trigram with the name is a candidate.
+                # Score those the way pg_trgm would. Without the FTS index,
+                # every therapist in the clinic is scored.
+                terms = " OR ".join(f'"{x}"' for x in search.trigrams(name))
+                candidates = []
+                if not FTS_TRIGRAM:
+                    candidates = query.all()
+                elif terms:
+                    candidates = query.filter(
+                        Therapist.id.in_(
+                            db.text(
+                                "SELECT rowid FROM therapists_fts"
+                                " WHERE therapists_fts MATCH :terms"
+                            )
+                            .bindparams(terms=terms)
+                            .columns(db.column("rowid"))
+                        )
+                    ).all()
+                scored = sorted(
+                    (
+                        (-search.similarity(name, x.name), x.name, x.id, x)
+                        for x in candidates
+                    ),
+                    key=lambda x: x[:3],
+                )
+                rows = [x[3] for x in scored if -x[0] >= threshold]
+                rows = rows[offset : offset + per_page + 1]
+        else:
+            if name:
+                if dialect == "postgresql" or not FTS_TRIGRAM:
+                    escaped = search.escape_like(name)
+                    patterns = {"start": f"{escaped}%", "word": f"% {escaped}%"}
+                    lowered = db.func.lower(Therapist.name)
+                    query = query.filter(
+                        lowered.like(patterns["start"], escape="\\")
+                        | lowered.like(patterns["word"], escape="\\")
+                    )
+                else:
+                    # LIKE on a trigram FTS5 table is answered from its index,
+                    # but not with an ESCAPE clause. instr() drops the rows an
+                    # unescaped _ matched.
+                    needle = search.padded(name)[:-1]
+                    query = query.filter(
+                        Therapist.id.in_(
+                            db.text(
+                                "SELECT rowid FROM therapists_fts"
+                                " WHERE terms LIKE :pattern AND instr(terms, :needle)"
+                            )
+                            .bindparams(pattern=f"%{needle}%", needle=needle)
+                            .columns(db.column("rowid"))
+                        )
+                    )
+            rows = (
+                query.order_by(Therapist.name, Therapist.id)
+                .offset(offset)
+                .limit(per_page + 1)
+                .all()
+            )
+
+        result = ([x.to_dict() for x in rows[:per_page]], len(rows) > per_page)
+        search.cache.put(key, result, generation)
+        return result
+
+    @staticmethod
+    def scoped():
+        """Query for the therapists belonging to the current clinic.
+
+        Without a clinic, only therapists without one are visible, never
+        every clinic's.
+        """
+        return Therapist.query.filter_by(clinic_id=tenancy.current_clinic())
 
 
 class Specialism(db.Model):
@@ -45,3 +192,46 @@ class Specialism(db.Model):
     def save(self):
         db.session.add(self)
         db.session.commit()
+        search.cache.clear()
+
+
+# Name search indexes. Trigrams on Postgres serve both LIKE and similarity.
+# SQLite gets an FTS5 trigram index over the padded name (see search.padded),
+# so it holds the same trigrams as pg_trgm. Triggers keep it in step. The
+# trigram tokenizer needs SQLite 3.34, older versions search with plain LIKE.
+FTS_TRIGRAM = sqlite3.sqlite_version_info >= (3, 34, 0)
+FTS_TERMS = "'  ' || replace(lower(new.name), ' ', '   ') || ' '"
+event.listen(
+    Therapist.__table__,
+    "after_create",
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"),
+)
+event.listen(
+    Therapist.__table__,
+    "after_create",
+    DDL(
+        "CREATE INDEX ix_therapists_name_trgm ON therapists"
+        " USING gin (lower(name) gin_trgm_ops)"
+    ).execute_if(dialect="postgresql"),
+)
+for statement in (
+    "CREATE VIRTUAL TABLE therapists_fts USING fts5(terms, tokenize='trigram')",
+    "CREATE TRIGGER therapists_fts_insert AFTER INSERT ON therapists BEGIN"
+    f" INSERT INTO therapists_fts(rowid, terms) VALUES (new.id, {FTS_TERMS}); END",
+    "CREATE TRIGGER therapists_fts_delete AFTER DELETE ON therapists BEGIN"
+    " DELETE FROM therapists_fts WHERE rowid = old.id; END",
+    "CREATE TRIGGER therapists_fts_update AFTER UPDATE OF name ON therapists BEGIN"
+    f" UPDATE therapists_fts SET terms = {FTS_TERMS} WHERE rowid = new.id; END",
+):
+    event.listen(
+        Therapist.__table__,
+        "after_create",
+        DDL(statement).execute_if(
+            dialect="sqlite", callable_=lambda *args, **kwargs: FTS_TRIGRAM
+        ),
+    )
+event.listen(
+    Therapist.__table__,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS therapists_fts").execute_if(dialect="sqlite"),
+)
@@ -4,7 +4,7 @@ from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask import current_app as app
 
-from application import db
+from application import db, jobs
 
 
 class User(db.Model):
@@ -14,16 +14,23 @@ class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), index=True, unique=True)
     password_hash = db.Column(db.String(128))
+    clinic_id = db.Column(db.String(64), index=True)
     appointments = db.relationship("Appointment", back_populates="client")
 
     def __repr__(self):
         return "User email: {0}".format(self.email)
 
-    def __init__(self, email):
+    def __init__(self, email, clinic_id=None):
         self.email = email
+        self.clinic_id = clinic_id
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        # Werkzeug's default method unless one is configured, e.g. for tests
+        method = app.config.get("PASSWORD_HASH_METHOD")
+        if method is None:
+            self.password_hash = generate_password_hash(password)
+        else:
+            self.password_hash = generate_password_hash(password, method=method)
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
@@ -36,6 +43,8 @@ class User(db.Model):
                 "exp": datetime.utcnow() + timedelta(minutes=5),
                 "iat": datetime.utcnow(),
                 "sub": self.email,
+                # Requests are scoped to this clinic, whatever they ask for
+                "clinic": self.clinic_id,
             }
             # Create byte string token using payload and SECRET
             jwt_string = jwt.encode(
@@ -49,15 +58,21 @@ class User(db.Model):
 
     @staticmethod
     def decode_token(token):
-        """Decodes access token from Authorisation header."""
+        """Decodes access token from Authorisation header.
+
+        Returns the user id and clinic id, or an error string.
+        """
         try:
             payload = jwt.decode(token, app.config.get("SECRET"), algorithms="HS256")
-            return payload["sub"].encode()
+            return payload["sub"].encode(), payload["clinic"]
         except jwt.ExpiredSignatureError:
             return "Expired token. Please login to get new token."
-        except jwt.InvalidTokenError:
+        except (jwt.InvalidTokenError, KeyError):
             return "Invalid token. Please register or login."
 
     def save(self):
         db.session.add(self)
+        db.session.flush()
+        job = jobs.enqueue("user_registered", user_id=self.id)
         db.session.commit()
+        jobs.dispatch(job)
@@ -0,0 +1,76 @@
+import os
+import unittest
+from sqlalchemy import event
+from application import db
+from application.tenancy import RoutingSession
+from wsgi import app
+
+# Process that created the schema. Each parallel test worker builds its own.
+_schema_pid = None
+
+
+def _do_connect(dbapi_connection, connection_record):
+    dbapi_connection.isolation_level = None
+
+
+def _do_begin(connection):
+    connection.exec_driver_sql("BEGIN")
+
+
+def use_savepoints(engine):
+    """Let pysqlite run SAVEPOINTs inside an outer transaction.
+
+    By default pysqlite manages transactions itself and breaks nested
+    ones, so hand that over to SQLAlchemy.
+    """
+    if engine.dialect.name != "sqlite" or event.contains(engine, "begin", _do_begin):
+        return
+    event.listen(engine, "connect", _do_connect)
+    event.listen(engine, "begin", _do_begin)
+
+
+def create_schema():
+    """Create the schema once per process."""
+    global _schema_pid
+    if _schema_pid == os.getpid():
+        return
+    with app.app_context():
+        use_savepoints(db.engine)
+        # Don't share a connection (or an in-memory database) with a parent process
+        db.engine.dispose()
+        db.create_all()
+    _schema_pid = os.getpid()
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """Base test case running each test inside a transaction that is rolled back.
+
+    The schema is created once per process. Each test then runs in a
+    SAVEPOINT, which is restarted whenever the code under test commits or
+    rolls back. The outer transaction is rolled back afterwards, so no test
+    sees another's data.
+    """
+
+    def setUp(self):
+        create_schema()
+        self.app = app
+        with self.app.app_context():
+            self.connection = db.engine.connect()
+            self.transaction = self.connection.begin()
+            self.savepoint = self.connection.begin_nested()
+            self.saved_session = db.session
+            db.session = db.create_scoped_session(
+                options={"bind": self.connection, "binds": {}}
+            )
+        event.listen(RoutingSession, "after_transaction_end", self.restart_savepoint)
+
+    def restart_savepoint(self, session, transaction):
+        if not self.savepoint.is_active:
+            self.savepoint = self.connection.begin_nested()
+
+    def tearDown(self):
+        event.remove(RoutingSession, "after_transaction_end", self.restart_savepoint)
+        db.session.remove()
+        db.session = self.saved_session
+        self.transaction.rollback()
+        self.connection.close()
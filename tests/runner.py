@@ -0,0 +1,48 @@
+import io
+import multiprocessing
+import unittest
+
+
+def flatten(suite):
+    """Yield the individual test cases in a suite."""
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from flatten(test)
+        else:
+            yield test
+
+
+def run_names(names):
+    """Run the named tests, returning the output and result counts."""
+    suite = unittest.TestLoader().loadTestsFromNames(names)
+    stream = io.StringIO()
+    result = unittest.TextTestRunner(stream=stream, verbosity=3).run(suite)
+    return stream.getvalue(), result.testsRun, len(result.failures), len(result.errors)
+
+
+def run_parallel(suite, workers):
+    """Run a suite across worker processes.
+
+    Test case classes are kept together and dealt out to the workers, which
+    each get their own in-memory database. Returns True if every test passed.
+    """
+    classes = {}
+    for test in flatten(suite):
+        classes.setdefault(test.id().rsplit(".", 1)[0], []).append(test.id())
+    chunks = [[] for _ in range(workers)]
+    for i, names in enumerate(classes.values()):
+        chunks[i % workers].extend(names)
+
+    with multiprocessing.get_context("fork").Pool(workers) as pool:
+        results = pool.map(run_names, [x for x in chunks if x])
+
+    run = failures = errors = 0
+    for output, tests_run, failed, errored in results:
+        print(output)
+        run += tests_run
+        failures += failed
+        errors += errored
+    print(
+        f"Ran {run} tests in {workers} workers: {failures} failures, {errors} errors."
+    )
+    return not failures and not errors
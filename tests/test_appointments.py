@@ -1,30 +1,26 @@
-import unittest
 import json
 import os
 from datetime import datetime, date, timedelta
-from application import create_app, db
-from wsgi import app
+from application import create_app
+from .base import DatabaseTestCase
 from models.user import User
 from models.therapist import Therapist, Specialism
 from models.appointment import Appointment
 from .create_dummy_data import insert_dummy_data
 
 
-class AppointmentTestCase(unittest.TestCase):
+class AppointmentTestCase(DatabaseTestCase):
     """Test case for the appointments."""
 
     def setUp(self):
         """Set up test variables."""
-        self.app = app
+        super().setUp()
         self.client = self.app.test_client()
         self.email = "test@example.com"
         self.user_data = json.dumps({"email": self.email, "password": "test_password"})
 
         with self.app.app_context():
             self.token = User(self.email).generate_token()
-            db.session.close()
-            db.drop_all()
-            db.create_all()
             insert_dummy_data(self.app)
 
     def get_result(self, endpoint):
@@ -135,6 +131,17 @@ class AppointmentTestCase(unittest.TestCase):
         )
         self.assertEqual(result["message"], "Invalid start time or duration.")
         self.assertEqual(res.status_code, 400)
+        # Other ISO forms of the same length aren't accepted
+        res, result = self.get_post_result(
+            "/add_appointment?start=2030-06-20 1241Z&duration=60&type=one-off&therapist_id=1"
+        )
+        self.assertEqual(result["message"], "Invalid start time or duration.")
+        self.assertEqual(res.status_code, 400)
+        res, result = self.get_post_result(
+            "/add_appointment?start=2030-W25-1 12:41&duration=60&type=one-off&therapist_id=1"
+        )
+        self.assertEqual(result["message"], "Invalid start time or duration.")
+        self.assertEqual(res.status_code, 400)
 
     def test_cant_add_without_therapist(self):
         """Test that an appointment cannot be added without a valid therapist id."""
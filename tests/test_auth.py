@@ -1,15 +1,17 @@
-import unittest
 import json
-from application import create_app, db
-from wsgi import app
+from sqlalchemy import event
+from application import create_app
+from models.refresh_token import RefreshToken
+from models.user import User
+from .base import DatabaseTestCase
 
 
-class AuthTestCase(unittest.TestCase):
+class AuthTestCase(DatabaseTestCase):
     """Test case for the authentication."""
 
     def setUp(self):
         """Set up test variables."""
-        self.app = app
+        super().setUp()
         self.client = self.app.test_client()
         self.user_data = json.dumps(
             {"email": "test@example.com", "password": "test_password"}
@@ -18,11 +20,6 @@ class AuthTestCase(unittest.TestCase):
         self.bad_email = json.dumps({"email": 1234, "password": "test_password"})
         self.bad_password = json.dumps({"email": "test@example.com", "password": 1234})
 
-        with self.app.app_context():
-            db.session.close()
-            db.drop_all()
-            db.create_all()
-
     def test_registration(self):
         """Test user registration works correctly."""
         res = self.client.post(
@@ -85,6 +82,18 @@ class AuthTestCase(unittest.TestCase):
         self.assertEqual(result["message"], "Incorrect type for email and/or password.")
         self.assertEqual(res.status_code, 400)
 
+    def test_default_password_hash_method(self):
+        """Test passwords use Werkzeug's default method unless one is set."""
+        method = self.app.config.pop("PASSWORD_HASH_METHOD")
+        try:
+            with self.app.app_context():
+                user = User("test@example.com")
+                user.set_password("test_password")
+        finally:
+            self.app.config["PASSWORD_HASH_METHOD"] = method
+        self.assertFalse(user.password_hash.startswith(f"{method}$"))
+        self.assertTrue(user.check_password("test_password"))
+
     def test_user_login(self):
         """Test registered user can get a token."""
         res = self.client.post(
@@ -119,3 +128,92 @@ class AuthTestCase(unittest.TestCase):
         result = json.loads(res.data.decode())
         self.assertEqual(result["message"], "Invalid JSON data supplied.")
         self.assertEqual(res.status_code, 400)
+
+    def login(self):
+        self.client.post(
+            "/register",
+            json=self.user_data,
+            headers={"Content-Type": "application/json"},
+        )
+        res = self.client.post(
+            "/login", json=self.user_data, headers={"Content-Type": "application/json"}
+        )
+        return json.loads(res.data.decode())
+
+    def post_refresh(self, endpoint, refresh_token):
+        res = self.client.post(
+            endpoint,
+            json=json.dumps({"refresh_token": refresh_token}),
+            headers={"Content-Type": "application/json"},
+        )
+        return res, json.loads(res.data.decode())
+
+    def test_refresh_token(self):
+        """Test a refresh token can be exchanged for a new token."""
+        login = self.login()
+        self.assertTrue(login["refresh_token"])
+        res, result = self.post_refresh("/refresh", login["refresh_token"])
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(result["message"], "Token refreshed with 5 minute expiration.")
+        self.assertTrue(result["token"])
+        self.assertNotEqual(result["refresh_token"], login["refresh_token"])
+        # The token is usable on authenticated endpoints
+        res = self.client.get(
+            "/get_appointments?type=one-off",
+            headers={"Authorization": f"Bearer {result['token']}"},
+        )
+        self.assertEqual(res.status_code, 200)
+
+    def test_refresh_token_reuse(self):
+        """Test reusing a rotated refresh token revokes the whole chain."""
+        login = self.login()
+        res, first = self.post_refresh("/refresh", login["refresh_token"])
+        self.assertEqual(res.status_code, 200)
+        res, result = self.post_refresh("/refresh", login["refresh_token"])
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(result["message"], "Revoked refresh token. Please login.")
+        res, result = self.post_refresh("/refresh", first["refresh_token"])
+        self.assertEqual(res.status_code, 401)
+
+    def test_concurrent_refresh(self):
+        """Test only one of two racing requests can rotate a refresh token."""
+        login = self.login()
+        tokens = RefreshToken.__table__
+        raced = []
+
+        def rotate_elsewhere(connection, clause, *args):
+            # Stands in for another request rotating the token first
+            if not raced and clause.is_update and clause.table.name == tokens.name:
+                raced.append(True)
+                connection.execute(tokens.update().values(revoked=True))
+
+        event.listen(self.connection, "before_execute", rotate_elsewhere)
+        try:
+            res, result = self.post_refresh("/refresh", login["refresh_token"])
+        finally:
+            event.remove(self.connection, "before_execute", rotate_elsewhere)
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(result["message"], "Revoked refresh token. Please login.")
+        with self.app.app_context():
+            self.assertEqual(RefreshToken.query.count(), 1)
+
+    def test_revoke_refresh_token(self):
+        """Test a revoked refresh token cannot be used."""
+        login = self.login()
+        res, result = self.post_refresh("/revoke", login["refresh_token"])
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(result["message"], "Refresh token revoked.")
+        res, result = self.post_refresh("/refresh", login["refresh_token"])
+        self.assertEqual(res.status_code, 401)
+
+    def test_invalid_refresh_token(self):
+        """Test unknown or missing refresh tokens are rejected."""
+        res, result = self.post_refresh("/refresh", "not_a_token")
+        self.assertEqual(res.status_code, 401)
+        self.assertEqual(result["message"], "Invalid refresh token. Please login.")
+        res = self.client.post(
+            "/refresh",
+            json=self.user_data,
+            headers={"Content-Type": "application/json"},
+        )
+        self.assertEqual(res.status_code, 400)
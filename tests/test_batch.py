@@ -0,0 +1,79 @@
+import json
+from datetime import date, timedelta
+from models.user import User
+from .base import DatabaseTestCase
+from .create_dummy_data import insert_dummy_data
+
+
+class BatchTestCase(DatabaseTestCase):
+    """Test case for batched appointment queries."""
+
+    def setUp(self):
+        """Set up test variables."""
+        super().setUp()
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            self.token = User("test@example.com").generate_token()
+            insert_dummy_data(self.app)
+
+    def batch(self, queries):
+        res = self.client.post(
+            "/batch_appointments",
+            headers={"Authorization": f"Bearer {self.token}"},
+            json={"queries": queries},
+        )
+        return res, json.loads(res.data.decode())
+
+    def get(self, query):
+        res = self.client.get(
+            f"/get_appointments?{query}",
+            headers={"Authorization": f"Bearer {self.token}"},
+        )
+        return json.loads(res.data.decode())["appointments"]
+
+    def test_batch(self):
+        """Test each filter set gets the same results as /get_appointments."""
+        start = date.today().isoformat()
+        end = (date.today() + timedelta(days=7)).isoformat()
+        res, result = self.batch(
+            [
+                {"id": "addiction", "specialisms": "Addiction"},
+                {"type": "consultation", "start": start, "end": end},
+                {"specialisms": "Sexuality", "type": "one-off"},
+            ]
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(result["message"], "Queries run: 3")
+        results = result["results"]
+        self.assertEqual(set(results), {"addiction", "1", "2"})
+        for key, query in (
+            ("addiction", "specialisms=Addiction"),
+            ("1", f"type=consultation&start={start}&end={end}"),
+            ("2", "specialisms=Sexuality&type=one-off"),
+        ):
+            # Compare ignoring order
+            self.assertCountEqual(results[key], self.get(query))
+        self.assertEqual(len(results["addiction"]), 2)
+        self.assertEqual(len(results["1"]), 1)
+
+    def test_invalid_batch(self):
+        """Test invalid filter sets are rejected."""
+        for queries in (
+            [],
+            "type=one-off",
+            [{}],
+            [{"type": 1}],
+            [{"therapist": "John Smith"}],
+            [{"id": "a", "type": "one-off"}, {"id": "a", "type": "consultation"}],
+            [{"type": "one-off"}] * 26,
+        ):
+            res, _ = self.batch(queries)
+            self.assertEqual(res.status_code, 400, queries)
+
+    def test_batch_requires_token(self):
+        """Test the batch endpoint is authenticated."""
+        res = self.client.post(
+            "/batch_appointments", json={"queries": [{"type": "one-off"}]}
+        )
+        self.assertEqual(res.status_code, 401)
@@ -0,0 +1,100 @@
+import json
+import time
+from sqlalchemy import event, exc, text
+from application import db
+from models.user import User
+from .base import DatabaseTestCase
+from .create_dummy_data import insert_dummy_data
+
+# Counts far enough to run well past any test deadline
+SLOW_QUERY = text(
+    "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 100000000)"
+    " SELECT count(*) FROM c"
+)
+
+
+class DeadlinesTestCase(DatabaseTestCase):
+    """Test case for per-route time budgets."""
+
+    def setUp(self):
+        """Set up test variables."""
+        super().setUp()
+        self.client = self.app.test_client()
+        self.timeouts = dict(self.app.config["ROUTE_TIMEOUTS"])
+
+        with self.app.app_context():
+            self.token = User("test@example.com").generate_token()
+            insert_dummy_data(self.app)
+
+    def tearDown(self):
+        self.app.config["ROUTE_TIMEOUTS"] = self.timeouts
+        super().tearDown()
+
+    def test_request_within_budget(self):
+        """Test requests inside their budget are unaffected."""
+        res = self.client.get(
+            "/get_appointments?type=one-off",
+            headers={"Authorization": f"Bearer {self.token}"},
+        )
+        self.assertEqual(res.status_code, 200)
+
+    def test_exhausted_budget(self):
+        """Test a request out of time fails cleanly before querying."""
+        self.app.config["ROUTE_TIMEOUTS"]["get_appointments"] = 1e-9
+        res = self.client.get(
+            "/get_appointments?type=one-off",
+            headers={"Authorization": f"Bearer {self.token}"},
+        )
+        result = json.loads(res.data.decode())
+        self.assertEqual(res.status_code, 503)
+        self.assertEqual(result["message"], "Request took too long. Please try again.")
+
+    def test_exhausted_budget_on_auth_routes(self):
+        """Test auth routes out of time also fail with a 503."""
+        credentials = {"email": "someone@test.com", "password": "randompassword"}
+        for endpoint in ("login", "register"):
+            self.app.config["ROUTE_TIMEOUTS"][endpoint] = 1e-9
+            res = self.client.post(f"/{endpoint}", json=credentials)
+            result = json.loads(res.data.decode())
+            self.assertEqual(res.status_code, 503, endpoint)
+            self.assertEqual(
+                result["message"], "Request took too long. Please try again."
+            )
+
+    def test_other_database_errors_on_auth_routes(self):
+        """Test database errors other than timeouts keep the JSON 500."""
+
+        def locked(connection, clause, *args):
+            if getattr(clause, "is_select", False):
+                raise exc.OperationalError(
+                    "SELECT", {}, Exception("database is locked")
+                )
+
+        event.listen(self.connection, "before_execute", locked)
+        try:
+            res = self.client.post(
+                "/login", json={"email": "test@example.com", "password": "password"}
+            )
+        finally:
+            event.remove(self.connection, "before_execute", locked)
+        result = json.loads(res.data.decode())
+        self.assertEqual(res.status_code, 500)
+        self.assertIn("database is locked", result["message"])
+
+    def test_slow_query_interrupted(self):
+        """Test a running SQLite query is interrupted at the deadline."""
+        self.app.config["ROUTE_TIMEOUTS"]["get_appointments"] = 0.05
+        with self.app.test_request_context("/get_appointments?type=one-off"):
+            self.app.preprocess_request()
+            started = time.monotonic()
+            with self.assertRaises(exc.OperationalError) as error:
+                db.session.execute(SLOW_QUERY)
+            self.assertLess(time.monotonic() - started, 1)
+            self.assertIn("interrupted", str(error.exception))
+            res = self.app.make_response(
+                self.app.handle_user_exception(error.exception)
+            )
+            self.assertEqual(res.status_code, 503)
+        # The handler is removed once the request ends
+        with self.app.app_context():
+            self.assertEqual(db.session.execute(text("SELECT 1")).scalar(), 1)
@@ -0,0 +1,135 @@
+import json
+import time
+from datetime import datetime, timedelta
+from application.events import Broker, broker
+from .base import DatabaseTestCase
+from models.user import User
+from models.therapist import Therapist
+from models.appointment import Appointment
+from .create_dummy_data import insert_dummy_data
+
+
+class EventsTestCase(DatabaseTestCase):
+    """Test case for the appointment event feed."""
+
+    def setUp(self):
+        """Set up test variables."""
+        super().setUp()
+        self.client = self.app.test_client()
+        self.event = {
+            "id": 1,
+            "clinic_id": None,
+            "change": "insert",
+            "time": "2022-06-06 09:41:00",
+            "duration": 60.0,
+            "therapist": "John Smith",
+            "type": "one-off",
+            "specialisms": ["Addiction", "CBT"],
+        }
+
+        with self.app.app_context():
+            self.token = User("test@example.com").generate_token()
+            insert_dummy_data(self.app)
+
+    def add_appointment(self, therapist_id, appointment_type):
+        with self.app.app_context():
+            therapist = Therapist.query.get(therapist_id)
+            appointment = Appointment(
+                datetime.now() + timedelta(days=30),
+                timedelta(minutes=60),
+                appointment_type,
+                therapist,
+            )
+            return appointment.save()
+
+    def test_broker_fans_out(self):
+        """Test every subscription receives published events."""
+        local = Broker()
+        first, second = local.subscribe(), local.subscribe()
+        local.publish(self.event)
+        self.assertEqual(first.get(timeout=0), self.event)
+        self.assertEqual(second.get(timeout=0), self.event)
+        local.unsubscribe(second)
+        local.publish(self.event)
+        self.assertEqual(first.get(timeout=0), self.event)
+        self.assertIsNone(second.get(timeout=0))
+
+    def test_subscription_filters(self):
+        """Test subscriptions only receive events matching their filters."""
+        local = Broker()
+        by_specialism = local.subscribe(specialisms=["Sexuality"])
+        by_type = local.subscribe(types=["one-off"])
+        local.publish(self.event)
+        self.assertIsNone(by_specialism.get(timeout=0))
+        self.assertEqual(by_type.get(timeout=0), self.event)
+
+    def test_subscriptions_only_see_own_clinic(self):
+        """Test events are only sent to subscribers in the same clinic."""
+        local = Broker()
+        east, unscoped = local.subscribe("east"), local.subscribe()
+        local.publish(dict(self.event, clinic_id="east"))
+        self.assertEqual(east.get(timeout=0)["clinic_id"], "east")
+        self.assertIsNone(unscoped.get(timeout=0))
+
+    def test_subscription_buffer_is_bounded(self):
+        """Test slow subscribers drop their oldest events."""
+        local = Broker()
+        subscription = local.subscribe(maxsize=2)
+        for i in range(5):
+            local.publish(dict(self.event, id=i))
+        self.assertEqual(subscription.dropped, 3)
+        self.assertEqual(subscription.get(timeout=0)["id"], 3)
+        self.assertEqual(subscription.get(timeout=0)["id"], 4)
+
+    def test_save_publishes_after_commit(self):
+        """Test saving an appointment publishes an insert event."""
+        subscription = broker.subscribe(specialisms=["Addiction"])
+        try:
+            self.assertEqual(self.add_appointment(2, "one-off"), "Appointment added.")
+            self.assertIsNone(subscription.get(timeout=0))
+            self.assertEqual(self.add_appointment(1, "one-off"), "Appointment added.")
+            event = subscription.get(timeout=0)
+            self.assertEqual(event["change"], "insert")
+            self.assertEqual(event["therapist"], "John Smith")
+            self.assertEqual(event["duration"], 60.0)
+        finally:
+            broker.unsubscribe(subscription)
+
+    def test_stream_appointments(self):
+        """Test appointment changes are streamed as server-sent events."""
+        res = self.client.get(
+            "/stream_appointments?type=consultation",
+            headers={"Authorization": f"Bearer {self.token}"},
+        )
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.mimetype, "text/event-stream")
+        self.add_appointment(1, "one-off")
+        self.add_appointment(2, "consultation")
+        chunks = iter(res.response)
+        self.assertEqual(next(chunks), b": connected\nretry: 1000\n\n")
+        chunk = next(chunks).decode()
+        self.assertTrue(chunk.startswith("event: appointment\n"))
+        event = json.loads(chunk.split("data: ")[1])
+        self.assertEqual(event["type"], "consultation")
+        self.assertEqual(event["therapist"], "Jane Smith")
+        res.close()
+
+    def test_stream_is_bounded(self):
+        """Test streams close after EVENTS_STREAM_SECONDS."""
+        self.app.config["EVENTS_STREAM_SECONDS"] = 0.1
+        try:
+            res = self.client.get(
+                "/stream_appointments",
+                headers={"Authorization": f"Bearer {self.token}"},
+            )
+            started = time.monotonic()
+            chunks = list(res.response)
+        finally:
+            self.app.config["EVENTS_STREAM_SECONDS"] = 30
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(chunks, [b": connected\nretry: 1000\n\n"])
+
+    def test_stream_requires_token(self):
+        """Test the stream cannot be opened without a token."""
+        res = self.client.get("/stream_appointments")
+        self.assertEqual(res.status_code, 401)
@@ -0,0 +1,146 @@
+import json
+import time
+from datetime import datetime, timedelta
+from application import db
+from application.idempotency import fingerprint
+from models.user import User
+from models.appointment import Appointment
+from models.idempotency_key import IdempotencyKey
+from .base import DatabaseTestCase
+from .create_dummy_data import insert_dummy_data
+
+
+class IdempotencyTestCase(DatabaseTestCase):
+    """Test case for Idempotency-Key handling on /add_appointment."""
+
+    def setUp(self):
+        """Set up test variables."""
+        super().setUp()
+        self.client = self.app.test_client()
+        start = (datetime.now() + timedelta(days=60)).strftime("%Y-%m-%d %H:%M")
+        self.url = (
+            f"/add_appointment?start={start}&duration=60&type=one-off&therapist_id=1"
+        )
+
+        with self.app.app_context():
+            self.token = User("test@example.com").generate_token()
+            insert_dummy_data(self.app)
+
+    def add(self, key, url=None, token=None):
+        res = self.client.post(
+            url or self.url,
+            headers={
+                "Authorization": f"Bearer {token or self.token}",
+                "Idempotency-Key": key,
+            },
+        )
+        return res, json.loads(res.data.decode())
+
+    def count(self):
+        with self.app.app_context():
+            return Appointment.query.count()
+
+    def hold(self, key, created_at=None):
+        """Store an in-flight row for key, as if another request held it."""
+        with self.app.test_request_context(self.url, method="POST"):
+            digest = fingerprint()
+        with self.app.app_context():
+            record = IdempotencyKey(
+                IdempotencyKey.hash(User.decode_token(self.token)[0], key), digest
+            )
+            record.created_at = created_at or record.created_at
+            db.session.add(record)
+            db.session.commit()
+
+    def test_retry_replays_response(self):
+        """Test a retry gets the stored response without booking again."""
+        before = self.count()
+        res, result = self.add("booking-1")
+        self.assertEqual(res.status_code, 200)
+        self.assertNotIn("Idempotent-Replayed", res.headers)
+        res, retried = self.add("booking-1")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(retried, result)
+        self.assertEqual(self.count(), before + 1)
+        # Without a key the same booking is rejected as overlapping
+        res = self.client.post(
+            self.url, headers={"Authorization": f"Bearer {self.token}"}
+        )
+        self.assertEqual(res.status_code, 400)
+
+    def test_key_reused_for_different_request(self):
+        """Test a key can't be replayed for a different booking."""
+        self.add("booking-1")
+        res, result = self.add(
+            "booking-1", self.url.replace("duration=60", "duration=30")
+        )
+        self.assertEqual(res.status_code, 422)
+
+    def test_keys_are_per_user(self):
+        """Test the same key from another user is a separate request."""
+        self.add("booking-1")
+        with self.app.app_context():
+            other = User("other@example.com").generate_token()
+        res, result = self.add("booking-1", token=other)
+        self.assertEqual(result["message"], "Overlapping with existing appointment.")
+
+    def test_in_flight_duplicate(self):
+        """Test a duplicate of a request still in flight waits, then gives up."""
+        self.hold("booking-1")
+        self.app.config["IDEMPOTENCY_WAIT_SECONDS"] = 0.1
+        try:
+            res, result = self.add("booking-1")
+        finally:
+            self.app.config["IDEMPOTENCY_WAIT_SECONDS"] = 10
+        self.assertEqual(res.status_code, 409)
+        self.assertEqual(self.count(), 4)
+
+    def test_rejected_booking_not_committed(self):
+        """Test a rejected idempotent booking leaves nothing behind."""
+        start = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d %H:%M")
+        res, result = self.add(
+            "booking-1",
+            f"/add_appointment?start={start}&duration=60&type=one-off&therapist_id=1",
+        )
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(result["message"], "Cannot add an appointment in the past.")
+        self.assertEqual(self.count(), 4)
+        # Nor does an overlapping one
+        self.add("booking-2")
+        res, result = self.add("booking-3")
+        self.assertEqual(result["message"], "Overlapping with existing appointment.")
+        self.assertEqual(self.count(), 5)
+
+    def test_in_flight_duplicate_within_budget(self):
+        """Test waiting for an in-flight duplicate stops at the request's budget."""
+        self.hold("booking-1")
+        self.app.config["ROUTE_TIMEOUTS"]["add_appointment"] = 0.3
+        self.app.config["IDEMPOTENCY_WAIT_SECONDS"] = 1.5
+        try:
+            started = time.monotonic()
+            res, result = self.add("booking-1")
+            elapsed = time.monotonic() - started
+        finally:
+            self.app.config["ROUTE_TIMEOUTS"]["add_appointment"] = 5
+            self.app.config["IDEMPOTENCY_WAIT_SECONDS"] = 10
+        self.assertEqual(res.status_code, 409)
+        self.assertLess(elapsed, 1)
+        self.assertEqual(self.count(), 4)
+
+    def test_abandoned_key_is_retaken(self):
+        """Test a key left in flight by a crashed request can be used again."""
+        self.hold("booking-1", datetime.utcnow() - timedelta(minutes=5))
+        res, result = self.add("booking-1")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(result["message"], "Appointment added.")
+
+    def test_prune(self):
+        """Test expired keys are pruned."""
+        self.add("booking-1")
+        with self.app.app_context():
+            IdempotencyKey.query.update(
+                {"expires_at": datetime.utcnow() - timedelta(seconds=1)}
+            )
+            db.session.commit()
+            self.assertEqual(IdempotencyKey.prune(), 1)
@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+from application import db, jobs
+from .base import DatabaseTestCase
+from models.job import Job
+from models.user import User
+
+
+class JobsTestCase(DatabaseTestCase):
+    """Test case for the background job queue."""
+
+    def setUp(self):
+        """Set up test variables."""
+        super().setUp()
+        self.calls = []
+
+        @jobs.job("test_job")
+        def record(value):
+            self.calls.append(value)
+
+        @jobs.job("failing_job")
+        def fail():
+            raise RuntimeError("boom")
+
+    def tearDown(self):
+        jobs.handlers.pop("test_job")
+        jobs.handlers.pop("failing_job")
+        self.app.config["JOBS_SYNCHRONOUS"] = True
+        super().tearDown()
+
+    def test_save_enqueues_job(self):
+        """Test saving a user enqueues and runs its job in synchronous mode."""
+        with self.app.app_context():
+            user = User("test@example.com")
+            user.set_password("test_password")
+            user.save()
+            job = Job.query.filter_by(name="user_registered").one()
+            self.assertEqual(job.kwargs, {"user_id": user.id})
+            self.assertEqual(job.status, "done")
+
+    def test_synchronous_dispatch(self):
+        """Test jobs run inline when synchronous mode is enabled."""
+        with self.app.app_context():
+            job = jobs.enqueue("test_job", value=1)
+            db.session.commit()
+            jobs.dispatch(job)
+            self.assertEqual(self.calls, [1])
+            self.assertEqual(job.status, "done")
+            self.assertEqual(job.attempts, 1)
+
+    def test_worker_processes_queue(self):
+        """Test queued jobs are left for, and run by, the worker."""
+        self.app.config["JOBS_SYNCHRONOUS"] = False
+        with self.app.app_context():
+            job = jobs.enqueue("test_job", value=2)
+            db.session.commit()
+            jobs.dispatch(job)
+            self.assertEqual(self.calls, [])
+            self.assertEqual(job.status, "queued")
+            jobs.work(once=True)
+            self.assertEqual(self.calls, [2])
+            self.assertEqual(Job.query.get(job.id).status, "done")
+
+    def test_failed_job_retried_with_backoff(self):
+        """Test failing jobs are rescheduled with backoff until attempts run out."""
+        self.app.config["JOBS_SYNCHRONOUS"] = False
+        with self.app.app_context():
+            job = jobs.enqueue("failing_job")
+            db.session.commit()
+            jobs.work(once=True)
+            job = Job.query.get(job.id)
+            self.assertEqual(job.status, "queued")
+            self.assertEqual(job.attempts, 1)
+            self.assertIn("boom", job.last_error)
+            self.assertGreater(job.run_at, datetime.utcnow())
+            # Exhaust the remaining attempts
+            for _ in range(job.max_attempts - 1):
+                job.run_at = datetime.utcnow() - timedelta(seconds=1)
+                db.session.commit()
+                jobs.work(once=True)
+                job = Job.query.get(job.id)
+            self.assertEqual(job.status, "failed")
+            self.assertEqual(job.attempts, job.max_attempts)
+
+    def test_backoff_is_capped(self):
+        """Test backoff grows exponentially up to the configured maximum."""
+        with self.app.app_context():
+            self.assertEqual(jobs.backoff(1), timedelta(seconds=2))
+            self.assertEqual(jobs.backoff(3), timedelta(seconds=8))
+            self.assertEqual(jobs.backoff(30), timedelta(seconds=600))
@@ -0,0 +1,85 @@
+import unittest
+import logging
+import os
+from application.logs import AsyncHandler, SamplingFilter, setup_logging
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def make_record(msg, level=logging.ERROR):
+    return logging.LogRecord("main", level, __file__, 1, msg, None, None)
+
+
+class LogsTestCase(unittest.TestCase):
+    """Test case for the background logging pipeline."""
+
+    def test_async_handler_delivers_records(self):
+        """Test records reach the target handler from the background thread."""
+        target = ListHandler()
+        handler = AsyncHandler(target, 10)
+        handler.handle(make_record({"message": "Expired token."}))
+        handler.handle(make_record("Plain %s"))
+        handler.stop()
+        self.assertEqual(len(target.records), 2)
+        # Dict messages are left for the JSON formatter
+        self.assertEqual(target.records[0].msg, {"message": "Expired token."})
+        self.assertEqual(target.records[1].msg, "Plain %s")
+
+    def test_async_handler_drops_when_full(self):
+        """Test a full queue drops records instead of blocking."""
+        handler = AsyncHandler(ListHandler(), 2)
+        # Pretend the listener is running so nothing drains the queue
+        handler._pid = os.getpid()
+        for i in range(5):
+            handler.handle(make_record(f"message {i}"))
+        self.assertEqual(handler.dropped, 3)
+        handler.queue.get_nowait()
+        handler.handle(make_record("after"))
+        self.assertEqual(handler.queue.get_nowait().msg, "message 1")
+        self.assertEqual(handler.queue.get_nowait().dropped, 3)
+
+    def test_sampling_filter(self):
+        """Test repeated messages are sampled and the suppressed count reported."""
+        sampler = SamplingFilter(window=60, burst=2)
+        results = [
+            sampler.filter(make_record({"message": "Expired token."})) for _ in range(5)
+        ]
+        self.assertEqual(results, [True, True, False, False, False])
+        # Other messages are counted separately
+        self.assertTrue(sampler.filter(make_record("Something else")))
+        # Once the window passes the count of suppressed records is attached
+        sampler.window = 0
+        record = make_record({"message": "Expired token."})
+        self.assertTrue(sampler.filter(record))
+        self.assertEqual(record.suppressed, 3)
+
+    def test_setup_logging(self):
+        """Test configured handlers are wrapped in a single async handler."""
+        logger = logging.getLogger("main")
+        root = logging.getLogger()
+        target = ListHandler()
+        saved = logger.handlers, root.handlers
+        logger.handlers, root.handlers = [target], [target]
+        try:
+            config = {
+                "LOG_ASYNC": True,
+                "LOG_QUEUE_SIZE": 10,
+                "LOG_SAMPLE_WINDOW_SECONDS": 1,
+                "LOG_SAMPLE_BURST": 5,
+            }
+            setup_logging(config)
+            setup_logging(config)
+            self.assertEqual(len(logger.handlers), 1)
+            self.assertIsInstance(logger.handlers[0], AsyncHandler)
+            self.assertIs(logger.handlers[0], root.handlers[0])
+            self.assertIs(logger.handlers[0].target, target)
+            logger.handlers[0].stop()
+        finally:
+            logger.handlers, root.handlers = saved
@@ -0,0 +1,94 @@
+import unittest
+import os
+import pstats
+import tempfile
+import threading
+import time
+from flask import Flask
+from application import profiling
+
+
+class ProfilingTestCase(unittest.TestCase):
+    """Test case for on-demand request profiling."""
+
+    def setUp(self):
+        """Set up test variables."""
+        self.dir = tempfile.TemporaryDirectory()
+        self.app = Flask(__name__)
+        self.app.config.update(
+            PROFILING_ENABLED=True,
+            PROFILING_TOKEN="admin",
+            PROFILING_HEADER="X-Profile",
+            PROFILING_SAMPLE_RATE=0.0,
+            PROFILING_MODE="cprofile",
+            PROFILING_SAMPLE_INTERVAL=0.001,
+            PROFILING_DIR=self.dir.name,
+        )
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def make_client(self):
+        profiling.init_app(self.app)
+
+        @self.app.route("/slow")
+        def slow():
+            time.sleep(0.02)
+            return "done"
+
+        @self.app.route("/fail")
+        def fail():
+            raise RuntimeError("failed")
+
+        return self.app.test_client()
+
+    def test_disabled_registers_nothing(self):
+        """Test no hooks are added when profiling is disabled."""
+        self.app.config["PROFILING_ENABLED"] = False
+        profiling.init_app(self.app)
+        self.assertEqual(self.app.before_request_funcs, {})
+        self.assertEqual(self.app.after_request_funcs, {})
+        self.assertEqual(self.app.teardown_request_funcs, {})
+
+    def test_header_triggers_cprofile(self):
+        """Test the admin header writes a pstats file for the request."""
+        client = self.make_client()
+        res = client.get("/slow")
+        self.assertNotIn("X-Profile-Output", res.headers)
+        res = client.get("/slow", headers={"X-Profile": "wrong"})
+        self.assertNotIn("X-Profile-Output", res.headers)
+        self.assertEqual(os.listdir(self.dir.name), [])
+        res = client.get("/slow", headers={"X-Profile": "admin"})
+        output = res.headers["X-Profile-Output"]
+        self.assertTrue(output.endswith(".prof"))
+        stats = pstats.Stats(os.path.join(self.dir.name, output))
+        self.assertTrue(any(func[2] == "slow" for func in stats.stats))
+
+    def test_sample_rate_triggers_sampler(self):
+        """Test sampled requests write collapsed stacks."""
+        self.app.config["PROFILING_SAMPLE_RATE"] = 1.0
+        self.app.config["PROFILING_MODE"] = "sampler"
+        client = self.make_client()
+        res = client.get("/slow")
+        output = res.headers["X-Profile-Output"]
+        self.assertTrue(output.endswith(".folded"))
+        with open(os.path.join(self.dir.name, output)) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(any("slow (" in line for line in lines))
+        stack, count = lines[0].rsplit(" ", 1)
+        self.assertGreater(int(count), 0)
+
+    def test_profiler_stopped_when_view_raises(self):
+        """Test profiling stops when an exception propagates past after_request."""
+        self.app.config["PROPAGATE_EXCEPTIONS"] = True
+        client = self.make_client()
+        for mode, extension in (("cprofile", ".prof"), ("sampler", ".folded")):
+            self.app.config["PROFILING_MODE"] = mode
+            with self.assertRaises(RuntimeError):
+                client.get("/fail", headers={"X-Profile": "admin"})
+            outputs = [x for x in os.listdir(self.dir.name) if x.endswith(extension)]
+            self.assertEqual(len(outputs), 1)
+        self.assertFalse(
+            [x for x in threading.enumerate() if isinstance(x, profiling.StackSampler)]
+        )
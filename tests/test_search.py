@@ -0,0 +1,107 @@
+import json
+from application import search
+from models.user import User
+from models import therapist
+from models.therapist import Therapist
+from .base import DatabaseTestCase
+from .create_dummy_data import add_specialisms, insert_dummy_data
+
+
+class SearchTestCase(DatabaseTestCase):
+    """Test case for therapist search."""
+
+    def setUp(self):
+        """Set up test variables."""
+        super().setUp()
+        self.client = self.app.test_client()
+        search.cache.clear()
+
+        with self.app.app_context():
+            self.token = User("test@example.com").generate_token()
+            insert_dummy_data(self.app)
+            add_specialisms(Therapist("Alice Jones"), ["Addiction"]).save()
+
+    def search(self, query):
+        res = self.client.get(
+            f"/therapists?{query}", headers={"Authorization": f"Bearer {self.token}"}
+        )
+        result = json.loads(res.data.decode())
+        names = [x["name"] for x in result.get("therapists", [])]
+        return res, result, names
+
+    def test_prefix_search(self):
+        """Test names match on the start of any word."""
+        _, result, names = self.search("name=smi")
+        self.assertEqual(names, ["Jane Smith", "John Smith"])
+        self.assertEqual(result["therapists"][0]["specialisms"], ["CBT", "Sexuality"])
+        _, _, names = self.search("name=Jo")
+        self.assertEqual(names, ["Alice Jones", "John Smith"])
+        _, _, names = self.search("name=mith")
+        self.assertEqual(names, [])
+
+    def test_fuzzy_search(self):
+        """Test fuzzy search tolerates typos and ranks the best match first."""
+        _, _, names = self.search("name=jon%20smyth&fuzzy=true")
+        self.assertEqual(names[0], "John Smith")
+        self.assertNotIn("Alice Jones", names)
+
+    def test_underscore_is_not_a_wildcard(self):
+        """Test _ in a name only matches an underscore."""
+        with self.app.app_context():
+            Therapist("Jo_n Doe").save()
+        for enabled in (True, False):
+            therapist.FTS_TRIGRAM = enabled
+            search.cache.clear()
+            try:
+                _, _, names = self.search("name=jo_")
+            finally:
+                therapist.FTS_TRIGRAM = True
+            self.assertEqual(names, ["Jo_n Doe"])
+
+    def test_search_without_fts(self):
+        """Test SQLite without the trigram tokenizer falls back to LIKE."""
+        therapist.FTS_TRIGRAM = False
+        try:
+            _, _, names = self.search("name=smi")
+            self.assertEqual(names, ["Jane Smith", "John Smith"])
+            _, _, names = self.search("name=mith")
+            self.assertEqual(names, [])
+            _, _, names = self.search("name=jon%20smyth&fuzzy=true")
+            self.assertEqual(names[0], "John Smith")
+            self.assertNotIn("Alice Jones", names)
+        finally:
+            therapist.FTS_TRIGRAM = True
+
+    def test_specialism_filters(self):
+        """Test specialisms can be required all together or any of."""
+        _, _, names = self.search("specialisms=Addiction,CBT")
+        self.assertEqual(names, ["John Smith"])
+        _, _, names = self.search("specialisms=Addiction,Sexuality&match=any")
+        self.assertEqual(names, ["Alice Jones", "Jane Smith", "John Smith"])
+        _, _, names = self.search("name=smith&specialisms=Addiction&match=any")
+        self.assertEqual(names, ["John Smith"])
+
+    def test_pagination(self):
+        """Test results are paged."""
+        _, result, names = self.search("per_page=2")
+        self.assertEqual(names, ["Alice Jones", "Jane Smith"])
+        self.assertTrue(result["more"])
+        _, result, names = self.search("per_page=2&page=2")
+        self.assertEqual(names, ["John Smith"])
+        self.assertFalse(result["more"])
+        res, _, _ = self.search("page=0")
+        self.assertEqual(res.status_code, 400)
+
+    def test_cache_invalidated_on_save(self):
+        """Test saving a therapist clears cached results."""
+        self.search("name=smith")
+        self.assertEqual(len(search.cache._entries), 1)
+        # Same query once normalised
+        self.search("name=%20SMITH%20")
+        self.assertEqual(len(search.cache._entries), 1)
+        with self.app.app_context():
+            therapist = Therapist.query.filter_by(name="Alice Jones").first()
+            therapist.name = "Alice Smith"
+            therapist.save()
+        _, _, names = self.search("name=smith")
+        self.assertEqual(names, ["Alice Smith", "Jane Smith", "John Smith"])
@@ -0,0 +1,99 @@
+import json
+from datetime import date, datetime, timedelta
+from application import db
+from models.user import User
+from models.therapist import Therapist
+from models.appointment import Appointment
+from models.appointment_stat import AppointmentStat
+from .base import DatabaseTestCase
+from .create_dummy_data import insert_dummy_data
+
+
+class StatsTestCase(DatabaseTestCase):
+    """Test case for the daily appointment stats."""
+
+    def setUp(self):
+        """Set up test variables."""
+        super().setUp()
+        self.client = self.app.test_client()
+        self.today = date.today().isoformat()
+
+        with self.app.app_context():
+            self.token = User("test@example.com").generate_token()
+            insert_dummy_data(self.app)
+
+    def stats(self, query=""):
+        res = self.client.get(
+            f"/stats{query}", headers={"Authorization": f"Bearer {self.token}"}
+        )
+        return res, json.loads(res.data.decode())
+
+    def rollup(self):
+        with self.app.app_context():
+            return sorted(
+                (x.day, x.therapist_id, x.appointment_type, x.minutes, x.slots)
+                for x in AppointmentStat.query
+            )
+
+    def test_stats(self):
+        """Test stats are broken down by therapist and type by default."""
+        res, result = self.stats(f"?start={self.today}&end={self.today}")
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(result["message"], "Stats found: 2")
+        self.assertEqual(
+            result["stats"][0],
+            {
+                "day": self.today,
+                "therapist_id": 1,
+                "therapist": "John Smith",
+                "type": "one-off",
+                "minutes": 60,
+                "slots": 1,
+            },
+        )
+
+    def test_stats_by_specialism(self):
+        """Test stats can be broken down by specialism."""
+        res, result = self.stats(f"?start={self.today}&end={self.today}&by=specialism")
+        self.assertEqual(res.status_code, 200)
+        totals = {x["specialism"]: (x["minutes"], x["slots"]) for x in result["stats"]}
+        # Both therapists specialise in CBT, so it sums every appointment that day
+        self.assertEqual(totals["CBT"], (120, 2))
+        self.assertEqual(totals["Addiction"], (60, 1))
+
+    def test_invalid_stats(self):
+        """Test invalid breakdowns and dates are rejected."""
+        res, _ = self.stats("?by=client")
+        self.assertEqual(res.status_code, 400)
+        res, _ = self.stats("?start=yesterday")
+        self.assertEqual(res.status_code, 400)
+
+    def test_rollup_follows_changes(self):
+        """Test updates and deletes move appointments between rollup rows."""
+        with self.app.app_context():
+            appointment = Appointment.query.get(1)
+            appointment.appointment_type = "consultation"
+            appointment.end_datetime += timedelta(minutes=15)
+            appointment.save()
+            Appointment.query.get(3).delete()
+        rows = [x for x in self.rollup() if x[0] == date.today()]
+        self.assertEqual(rows, [(date.today(), 1, "consultation", 75, 1)])
+
+    def test_rebuild(self):
+        """Test rebuilding the rollup matches the incremental one."""
+        with self.app.app_context():
+            Appointment(
+                datetime.now() + timedelta(days=3, hours=2),
+                timedelta(minutes=30),
+                "consultation",
+                Therapist.query.get(2),
+            ).save()
+        expected = self.rollup()
+        self.assertIn(
+            (date.today() + timedelta(days=3), 2, "consultation", 75, 2), expected
+        )
+        with self.app.app_context():
+            AppointmentStat.query.delete()
+            db.session.commit()
+            self.assertEqual(AppointmentStat.rebuild(), len(expected))
+        self.assertEqual(self.rollup(), expected)
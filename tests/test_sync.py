@@ -0,0 +1,119 @@
+import json
+from datetime import datetime, timedelta
+from models.user import User
+from models.therapist import Therapist
+from models.appointment import Appointment
+from models.appointment_change import AppointmentChange
+from .base import DatabaseTestCase
+from .create_dummy_data import insert_dummy_data
+
+
+class SyncTestCase(DatabaseTestCase):
+    """Test case for incremental appointment sync."""
+
+    def setUp(self):
+        """Set up test variables."""
+        super().setUp()
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            self.token = User("test@example.com").generate_token()
+            insert_dummy_data(self.app)
+
+    def sync(self, token=None):
+        endpoint = "/sync_appointments"
+        if token is not None:
+            endpoint += f"?token={token}"
+        res = self.client.get(
+            endpoint, headers={"Authorization": f"Bearer {self.token}"}
+        )
+        return res, json.loads(res.data.decode())
+
+    def add_appointment(self):
+        with self.app.app_context():
+            appointment = Appointment(
+                datetime.now() + timedelta(days=30),
+                timedelta(minutes=60),
+                "one-off",
+                Therapist.query.get(1),
+            )
+            appointment.save()
+            return appointment.id
+
+    def test_full_sync(self):
+        """Test syncing without a token returns every appointment."""
+        res, result = self.sync()
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(result["message"], "Changes found: 4")
+        self.assertEqual({x["change"] for x in result["changes"]}, {"insert"})
+        self.assertEqual(result["sync_token"], 4)
+        self.assertFalse(result["more"])
+
+    def test_sync_token_per_clinic(self):
+        """Test the full sync token only follows the user's own clinic."""
+        with self.app.app_context():
+            therapist = Therapist("Jane Doe", "west")
+            therapist.save()
+            Appointment(
+                datetime.now() + timedelta(days=30),
+                timedelta(minutes=60),
+                "one-off",
+                therapist,
+            ).save()
+        _, result = self.sync()
+        self.assertEqual(result["sync_token"], 4)
+
+    def test_delta_sync(self):
+        """Test syncing with a token only returns later changes."""
+        _, first = self.sync()
+        new_id = self.add_appointment()
+        with self.app.app_context():
+            Appointment.query.get(1).delete()
+            # A second save of the same appointment is collapsed into one change
+            appointment = Appointment.query.get(new_id)
+            appointment.appointment_type = "consultation"
+            appointment.save()
+        res, result = self.sync(first["sync_token"])
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(result["message"], "Changes found: 2")
+        changes = {x["id"]: x for x in result["changes"]}
+        self.assertEqual(changes[1], {"id": 1, "change": "delete"})
+        self.assertEqual(changes[new_id]["change"], "update")
+        self.assertEqual(changes[new_id]["type"], "consultation")
+        # Nothing further has changed
+        _, result = self.sync(result["sync_token"])
+        self.assertEqual(result["changes"], [])
+
+    def test_sync_pages(self):
+        """Test large deltas are split across pages."""
+        self.app.config["SYNC_PAGE_SIZE"] = 2
+        try:
+            _, result = self.sync(1)
+            self.assertEqual(len(result["changes"]), 2)
+            self.assertTrue(result["more"])
+            _, result = self.sync(result["sync_token"])
+            self.assertEqual(len(result["changes"]), 1)
+            self.assertFalse(result["more"])
+        finally:
+            self.app.config["SYNC_PAGE_SIZE"] = 500
+
+    def test_invalid_sync_token(self):
+        """Test invalid sync tokens are rejected."""
+        res, result = self.sync("abc")
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(result["message"], "Invalid sync token.")
+
+    def test_compact(self):
+        """Test compaction keeps only the latest change per appointment."""
+        with self.app.app_context():
+            appointment = Appointment.query.get(2)
+            appointment.appointment_type = "one-off"
+            appointment.save()
+            self.assertEqual(AppointmentChange.compact(), 1)
+            self.assertEqual(
+                [
+                    (x.appointment_id, x.change)
+                    for x in AppointmentChange.since(0, None)
+                ],
+                [(1, "insert"), (3, "insert"), (4, "insert"), (2, "update")],
+            )
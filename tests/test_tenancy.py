@@ -0,0 +1,247 @@
+import unittest
+import json
+from flask import g
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, event, select
+from sqlalchemy.pool import StaticPool
+from application import db, tenancy
+from wsgi import app
+from models.user import User
+from models.therapist import Therapist
+from models.appointment import Appointment
+from .base import DatabaseTestCase
+from .create_dummy_data import add_specialisms
+
+
+def add_clinic(clinic_id, name):
+    """Add a therapist with an appointment to clinic_id."""
+    therapist = Therapist(name, clinic_id)
+    therapist = add_specialisms(therapist, ["CBT"])
+    therapist.save()
+    Appointment(
+        datetime.now() + timedelta(days=1),
+        timedelta(minutes=60),
+        "one-off",
+        therapist,
+    ).save()
+
+
+class TenancyTestCase(DatabaseTestCase):
+    """Test case for routing clinics to their own database."""
+
+    def setUp(self):
+        """Set up test variables."""
+        super().setUp()
+        self.client = self.app.test_client()
+        self.user_data = json.dumps(
+            {"email": "test@example.com", "password": "test_password"}
+        )
+        self.app.config["TENANT_DATABASES"] = {"north": "sqlite://"}
+        self.app.config["SQLALCHEMY_BINDS"] = tenancy.tenant_binds(
+            self.app.config["TENANT_DATABASES"]
+        )
+
+        # The savepoint only covers the default database, so reset the shard
+        with self.app.app_context():
+            self.shard = tenancy.engine_for("north", db)
+            db.Model.metadata.drop_all(self.shard)
+            db.Model.metadata.create_all(self.shard)
+
+    def tearDown(self):
+        self.app.config["REGISTRATION_CLINIC"] = None
+        self.app.config["TENANT_DATABASES"] = {}
+        self.app.config["SQLALCHEMY_BINDS"] = {}
+        super().tearDown()
+
+    def test_sharded_clinic_uses_own_database(self):
+        """Test requests for a sharded clinic are served from its database."""
+        self.app.config["REGISTRATION_CLINIC"] = "north"
+        res = self.client.post(
+            "/register",
+            json=self.user_data,
+            headers={"Content-Type": "application/json"},
+        )
+        self.assertEqual(res.status_code, 201)
+        with self.app.app_context():
+            self.assertIsNone(User.query.first())
+            users = db.Model.metadata.tables["users"]
+            with self.shard.connect() as connection:
+                row = connection.execute(select(users)).one()
+            self.assertEqual(row.email, "test@example.com")
+            self.assertEqual(row.clinic_id, "north")
+
+    def get_appointments(self, clinic_id, headers=None):
+        with self.app.app_context():
+            token = User("test@example.com", clinic_id).generate_token()
+        res = self.client.get(
+            "/get_appointments?type=one-off",
+            headers={"Authorization": f"Bearer {token}", **(headers or {})},
+        )
+        return res, json.loads(res.data.decode())
+
+    def test_unsharded_clinics_share_default_database(self):
+        """Test clinics without a shard only see their own therapists."""
+        with self.app.app_context():
+            add_clinic("east", "John Smith")
+            add_clinic("west", "Jane Smith")
+        res, result = self.get_appointments("west", {"X-Clinic-Id": "west"})
+        self.assertEqual(result["message"], "Appointments found: 1")
+        self.assertEqual(result["appointments"][0]["therapist"], "Jane Smith")
+
+    def test_clinic_comes_from_token(self):
+        """Test requests are scoped to the token's clinic, not the header."""
+        with self.app.app_context():
+            add_clinic("east", "John Smith")
+            add_clinic("west", "Jane Smith")
+        # No header still only sees the token's clinic
+        res, result = self.get_appointments("west")
+        self.assertEqual(
+            [x["therapist"] for x in result["appointments"]], ["Jane Smith"]
+        )
+        # Asking for another clinic is refused
+        res, result = self.get_appointments("west", {"X-Clinic-Id": "east"})
+        self.assertEqual(res.status_code, 403)
+        # Users without a clinic don't see every clinic's data
+        res, result = self.get_appointments(None)
+        self.assertEqual(result["appointments"], [])
+
+    def test_login_token_carries_clinic(self):
+        """Test tokens from /login are scoped to the user's clinic."""
+        self.app.config["REGISTRATION_CLINIC"] = "west"
+        headers = {"Content-Type": "application/json"}
+        self.client.post("/register", json=self.user_data, headers=headers)
+        res = self.client.post("/login", json=self.user_data, headers=headers)
+        token = json.loads(res.data.decode())["token"]
+        with self.app.app_context():
+            self.assertEqual(User.decode_token(token)[1], "west")
+
+    def test_register_ignores_clinic_header(self):
+        """Test clients can't register themselves into a clinic."""
+        headers = {"Content-Type": "application/json", "X-Clinic-Id": "east"}
+        res = self.client.post("/register", json=self.user_data, headers=headers)
+        self.assertEqual(res.status_code, 201)
+        with self.app.app_context():
+            self.assertIsNone(User.query.one().clinic_id)
+
+
+class MoveTenantTestCase(unittest.TestCase):
+    """Test case for moving a clinic's data to another database.
+
+    move_tenant runs its own transactions on the engines it is given, which
+    can't be nested in DatabaseTestCase's savepoint. So these tests recreate
+    the schema instead.
+    """
+
+    def setUp(self):
+        """Set up test variables."""
+        self.app = app
+        self.client = self.app.test_client()
+
+        with self.app.app_context():
+            db.session.close()
+            db.drop_all()
+            db.create_all()
+
+    def tearDown(self):
+        self.app.config["TENANT_DATABASES"] = {}
+        self.app.config["SQLALCHEMY_BINDS"] = {}
+        # Leave the default database empty for the transactional test cases
+        with self.app.app_context():
+            db.session.close()
+            db.drop_all()
+            db.create_all()
+
+    def test_move_tenant(self):
+        """Test a clinic's data can be moved to another database."""
+        target = create_engine("sqlite://", poolclass=StaticPool)
+        with self.app.app_context():
+            add_clinic("east", "John Smith")
+            add_clinic("west", "Jane Smith")
+            counts = tenancy.move_tenant("east", db.engine, target, db.Model.metadata)
+            self.assertEqual(counts, {"users": 0, "therapists": 1, "appointments": 1})
+            self.assertEqual([x.name for x in Therapist.query.all()], ["Jane Smith"])
+            self.assertEqual(Appointment.query.count(), 1)
+        tables = db.Model.metadata.tables
+        with target.connect() as connection:
+            therapist = connection.execute(select(tables["therapists"])).one()
+            appointment = connection.execute(select(tables["appointments"])).one()
+            specialism = connection.execute(select(tables["specialism"])).one()
+        self.assertEqual(therapist.name, "John Smith")
+        self.assertEqual(appointment.therapist_id, therapist.id)
+        self.assertEqual(specialism.name, "CBT")
+
+    def sync(self, clinic_id, token):
+        # Inside an app context, so the request's session is removed with it.
+        # Under manage.py test the CLI's context would otherwise keep it open
+        # into move_tenant's own transaction.
+        with self.app.app_context():
+            access_token = User("test@example.com", clinic_id).generate_token()
+            res = self.client.get(
+                f"/sync_appointments?token={token}",
+                headers={"Authorization": f"Bearer {access_token}"},
+            )
+        return json.loads(res.data.decode())
+
+    def test_sync_after_move_tenant(self):
+        """Test sync tokens from before a move get a full resync."""
+        with self.app.app_context():
+            add_clinic("east", "John Smith")
+            add_clinic("west", "Jane Smith")
+        first = self.sync("east", 0)
+        self.assertEqual(len(first["changes"]), 1)
+        # Move east onto its own, empty database
+        self.app.config["TENANT_DATABASES"]["east"] = "sqlite://"
+        self.app.config["SQLALCHEMY_BINDS"] = tenancy.tenant_binds(
+            self.app.config["TENANT_DATABASES"]
+        )
+        with self.app.app_context():
+            shard = tenancy.engine_for("east", db)
+            db.Model.metadata.drop_all(shard)
+            tenancy.move_tenant("east", db.engine, shard, db.Model.metadata)
+            g.clinic_id = "east"
+            add_clinic("east", "John Smith")
+        result = self.sync("east", first["sync_token"])
+        self.assertTrue(result["reset"])
+        self.assertEqual(len(result["changes"]), 2)
+        self.assertEqual({x["change"] for x in result["changes"]}, {"insert"})
+        # The new token follows the target's change log
+        result = self.sync("east", result["sync_token"])
+        self.assertFalse(result["reset"])
+        self.assertEqual(result["changes"], [])
+        with self.app.app_context():
+            g.clinic_id = "east"
+            add_clinic("east", "John Smith")
+        result = self.sync("east", result["sync_token"])
+        self.assertFalse(result["reset"])
+        self.assertEqual(len(result["changes"]), 1)
+        # West's token is unaffected
+        self.assertFalse(self.sync("west", first["sync_token"])["reset"])
+
+    def test_move_tenant_keeps_rows_added_during_move(self):
+        """Test rows added to a clinic mid-move aren't deleted uncopied."""
+        target = create_engine("sqlite://", poolclass=StaticPool)
+        appointments = db.Model.metadata.tables["appointments"]
+        added = []
+
+        def book_during_move(connection, clause, *args):
+            # Stands in for a booking committed between the copy and the delete
+            if not added and clause.is_delete and clause.table is appointments:
+                added.append(
+                    connection.execute(
+                        appointments.insert().values(
+                            clinic_id="east",
+                            appointment_type="one-off",
+                            start_datetime=datetime.now() + timedelta(days=2),
+                            end_datetime=datetime.now() + timedelta(days=3),
+                        )
+                    ).inserted_primary_key[0]
+                )
+
+        with self.app.app_context():
+            add_clinic("east", "John Smith")
+            event.listen(db.engine, "before_execute", book_during_move)
+            try:
+                tenancy.move_tenant("east", db.engine, target, db.Model.metadata)
+            finally:
+                event.remove(db.engine, "before_execute", book_during_move)
+            self.assertEqual([x.id for x in Appointment.query.all()], added)